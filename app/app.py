@@ -1,16 +1,31 @@
 import os
+import json
 import logging
-from flask import Flask, request, render_template, jsonify
+from flask import (
+    Flask,
+    Response,
+    request,
+    render_template,
+    jsonify,
+    stream_with_context,
+)
 from dotenv import load_dotenv
 # Import modules
+from modules import chromadb_handler
 from modules.chromadb_handler import init_db
-from modules.document_manager import (
-    get_document_status,
-    index_documents,
-    query_vector_db,
+from modules.document_manager import get_document_status
+from modules.catalog import get_catalog
+from modules.lexical_index import get_lexical_index
+from modules.jobs import IndexJobManager
+from modules.watcher import DocsWatcher
+from modules.retrieval import retrieve, query_embedding_cache
+from modules.conversation import create_conversation_tracker
+from modules.summarizer import ConversationSummarizer
+from modules.ollama_client import (
+    fetch_model_info,
+    generate_response,
+    generate_response_stream,
 )
-from modules.conversation import ConversationTracker
-from modules.ollama_client import fetch_model_info, generate_response
 import config
 
 # Set up logging
@@ -26,8 +41,27 @@ load_dotenv()
 # Initialize database at application start
 db_client, collection = init_db()
 
+# Load the keyword index used by hybrid search, building it if it's missing
+if config.HYBRID_SEARCH and config.CHROMA_AVAILABLE:
+    get_lexical_index(collection)
+
+# Indexing runs as background jobs
+index_jobs = IndexJobManager(collection)
+
+# Reindexes documents after they are saved or changed on disk
+docs_watcher = DocsWatcher(config.DOCS_DIR, index_jobs)
+if config.WATCH_DOCS and config.CHROMA_AVAILABLE:
+    docs_watcher.start()
+
 # Initialize conversation tracker
-conversation_tracker = ConversationTracker()
+conversation_tracker = create_conversation_tracker()
+
+# Background summarizer for long conversations
+summarizer = ConversationSummarizer(
+    conversation_tracker,
+    keep_recent=config.SUMMARY_KEEP_RECENT,
+    min_new_messages=config.SUMMARY_MIN_NEW_MESSAGES,
+)
 
 
 # --- Web Routes ---
@@ -36,6 +70,24 @@ def index():
     return render_template("index.html")
 
 
+def _submit_index_job(specific_files=None, force_reindex=False):
+    """Submit an indexing job and respond with it"""
+    return _job_response(index_jobs.submit(
+        specific_files=specific_files, force_reindex=force_reindex))
+
+
+def _job_response(job):
+    """
+    Returns 202 with a submitted job's progress, or waits for the job and
+    returns its result if the request body sets "wait".
+    """
+    data = request.get_json(silent=True, force=True) or {}
+    if data.get("wait"):
+        job.wait()
+        return jsonify(job.result or {"status": "error", "error": job.error})
+    return jsonify({"status": "accepted", "job_id": job.id, "job": job.to_dict()}), 202
+
+
 @app.route("/index_docs", methods=["POST"])
 def index_endpoint():
     try:
@@ -44,8 +96,7 @@ def index_endpoint():
             if request.is_json
             else None
         )
-        result = index_documents(collection, specific_files=specific_files)
-        return jsonify(result)
+        return _submit_index_job(specific_files=specific_files)
     except Exception as e:
         logger.error(f"🔴 Error in index_docs endpoint: {e}")
         return jsonify(
@@ -59,6 +110,49 @@ def index_endpoint():
         )
 
 
+@app.route("/index_jobs", methods=["GET"])
+def index_jobs_endpoint():
+    """List indexing jobs and any interrupted run that can be resumed"""
+    return jsonify({"jobs": index_jobs.list_jobs(), "interrupted": index_jobs.interrupted()})
+
+
+@app.route("/index_jobs/<job_id>", methods=["GET"])
+def index_job_endpoint(job_id):
+    """Progress of an indexing job"""
+    job = index_jobs.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/index_jobs/<job_id>/cancel", methods=["POST"])
+def cancel_index_job_endpoint(job_id):
+    """Cancel a queued or running indexing job"""
+    job = index_jobs.cancel(job_id)
+    if job is None:
+        return jsonify({"status": "error", "error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/index_jobs/resume", methods=["POST"])
+def resume_index_job_endpoint():
+    """Resume an interrupted indexing run from its checkpoint"""
+    job = index_jobs.resume()
+    if job is None:
+        return jsonify({"status": "error", "error": "No interrupted indexing run to resume"}), 404
+    return jsonify({"status": "accepted", "job_id": job.id, "job": job.to_dict()}), 202
+
+
+@app.route("/prune_index", methods=["POST"])
+def prune_index_endpoint():
+    """Remove chunks of documents that no longer exist, as a queued job"""
+    try:
+        return _job_response(index_jobs.submit_prune())
+    except Exception as e:
+        logger.error(f"🔴 Error in prune_index endpoint: {e}")
+        return jsonify({"status": "error", "error": str(e)})
+
+
 @app.route("/document_status", methods=["GET"])
 def document_status_endpoint():
     try:
@@ -102,6 +196,19 @@ def status_endpoint():
             "model_base": model_info["base"],
             "indexed_docs": len(doc_status["indexed"]),
             "doc_files": [os.path.basename(p) for p in doc_status["indexed"]],
+            "embedding_cache": (
+                chromadb_handler.embedding_cache.get_stats()
+                if chromadb_handler.embedding_cache
+                else None
+            ),
+            "query_cache": query_embedding_cache.get_stats(),
+            "lexical_index": (
+                get_lexical_index().get_stats() if config.HYBRID_SEARCH else None
+            ),
+            "summarizer": summarizer.get_stats(),
+            "conversations": conversation_tracker.get_stats(),
+            "watcher": docs_watcher.get_stats(),
+            "catalog": get_catalog().get_stats(),
         }
     )
 
@@ -139,8 +246,7 @@ def get_doc_endpoint(file_path):
 def reindex_all_endpoint():
     """Force reindex of all documents"""
     try:
-        result = index_documents(collection, force_reindex=True)
-        return jsonify(result)
+        return _submit_index_job(force_reindex=True)
     except Exception as e:
         logger.error(f"🔴 Error in reindex_all endpoint: {e}")
         return jsonify(
@@ -170,6 +276,11 @@ def save_doc_endpoint(file_path):
         if result.get("status") == "error":
             return jsonify(result), 400
 
+        # Make the edit searchable within seconds; a watcher that's running
+        # would see the write too, and the debounce merges the two
+        if config.INDEX_ON_SAVE and config.CHROMA_AVAILABLE:
+            docs_watcher.notify(file_path.replace("%20", " "))
+
         return jsonify(result)
     except Exception as e:
         logger.error(
@@ -193,39 +304,42 @@ def chat():
         # Add user message to conversation history
         conversation_tracker.add_message(session_id, "user", message)
 
-        # Get relevant context from vector database
-        context = query_vector_db(collection, message)
+        # Get relevant context and sources from a single vector search
+        retrieval = retrieve(collection, message)
+        context = retrieval.context
 
-        # Get conversation history
-        history = conversation_tracker.get_conversation(session_id)
+        # Get conversation history, with the number of messages trimmed from it
+        history, history_offset, summary = conversation_tracker.get_snapshot(
+            session_id)
 
         # Generate response
+        usage = {}
         assistant_response, success = generate_response(
-            message, context, history)
+            message,
+            retrieval,
+            history,
+            session_id=session_id,
+            usage=usage,
+            summary=summary,
+            history_offset=history_offset,
+        )
 
         # Add assistant response to conversation
         conversation_tracker.add_message(
             session_id, "assistant", assistant_response)
 
-        # Get sources for the response
-        sources = []
-        if config.CHROMA_AVAILABLE and collection is not None:
-            try:
-                # Specify include parameter to prevent adding new vectors
-                results = collection.query(
-                    query_texts=[message], include=["metadatas"])
-                if results.get("metadatas") and results["metadatas"][0]:
-                    sources = [
-                        os.path.basename(m["source"]) for m in results["metadatas"][0]
-                    ]
-            except Exception as e:
-                logger.error(f"🔴 Error getting sources: {e}")
+        # Fold older turns into the running summary off the request path
+        if config.SUMMARY_ENABLED:
+            summarizer.schedule(session_id)
+
+        sources = retrieval.sources
 
         return jsonify(
             {
                 "response": assistant_response,
                 "context_used": bool(context),
                 "sources": sources,
+                "usage": usage,
             }
         )
     except Exception as e:
@@ -239,6 +353,80 @@ def chat():
         )
 
 
+def _sse(event, data):
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/chat_stream", methods=["POST"])
+def chat_stream():
+    """Streaming variant of /chat that forwards tokens as Server-Sent Events"""
+    data = request.get_json(silent=True, force=True) or {}
+    message = data.get("message", "")
+    session_id = data.get("session_id", "default")
+
+    def generate():
+        try:
+            # Add user message to conversation history
+            conversation_tracker.add_message(session_id, "user", message)
+
+            # Get relevant context and sources from a single vector search
+            retrieval = retrieve(collection, message)
+            context = retrieval.context
+
+            # Report sources before generation starts
+            yield _sse(
+                "sources",
+                {"sources": retrieval.sources, "context_used": bool(context)},
+            )
+
+            history, history_offset, summary = conversation_tracker.get_snapshot(
+                session_id)
+
+            parts = []
+            usage = {}
+            failed = False
+            try:
+                for token in generate_response_stream(
+                    message,
+                    retrieval,
+                    history,
+                    session_id=session_id,
+                    usage=usage,
+                    summary=summary,
+                    history_offset=history_offset,
+                ):
+                    parts.append(token)
+                    yield _sse("token", {"token": token})
+            except Exception as e:
+                logger.error(f"🔴 Error streaming response: {e}")
+                failed = True
+                yield _sse("error", {"error": str(e)})
+            finally:
+                # Keep whatever was produced, even if the client went away
+                if parts:
+                    conversation_tracker.add_message(
+                        session_id, "assistant", "".join(parts))
+                    if config.SUMMARY_ENABLED:
+                        summarizer.schedule(session_id)
+
+            # Every stream ends with done or error, even an empty generation
+            if not failed:
+                if not parts:
+                    logger.warning(
+                        f"🟡 Empty response generated for session {session_id}")
+                yield _sse("done", {"response": "".join(parts), "usage": usage})
+        except Exception as e:
+            logger.error(f"🔴 Error in chat_stream endpoint: {e}")
+            yield _sse("error", {"error": f"An error occurred: {str(e)}"})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     os.makedirs(config.DOCS_DIR, exist_ok=True)
 
@@ -11,9 +11,40 @@ load_dotenv()
 # --- Configuration ---
 DOCS_DIR = os.getenv("DOCS_DIR", "./network_docs")
 DB_DIR = os.getenv("DB_DIR", "./chroma_db")
+INDEX_MANIFEST_PATH = os.getenv(
+    "INDEX_MANIFEST_PATH", os.path.join(DB_DIR, "index_manifest.json")
+)
+INDEX_CHECKPOINT_PATH = os.getenv(
+    "INDEX_CHECKPOINT_PATH", os.path.join(DB_DIR, "index_checkpoint.json")
+)
+LEXICAL_INDEX_PATH = os.getenv(
+    "LEXICAL_INDEX_PATH", os.path.join(DB_DIR, "lexical_index.json")
+)
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "512"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "50"))
+CHUNK_BY_TOKENS = os.getenv("CHUNK_BY_TOKENS", "false").lower() == "true"
+CHUNK_MARKDOWN_SECTIONS = os.getenv("CHUNK_MARKDOWN_SECTIONS", "true").lower() == "true"
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "256"))
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", str(min(4, os.cpu_count() or 1))))
+INDEX_EMBED_WORKERS = int(os.getenv("INDEX_EMBED_WORKERS", "2"))
+INDEX_QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "32"))
+INDEX_CHECKPOINT_INTERVAL = float(os.getenv("INDEX_CHECKPOINT_INTERVAL", "5"))
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "2"))
+INDEX_ON_SAVE = os.getenv("INDEX_ON_SAVE", "true").lower() == "true"
+WATCH_DOCS = os.getenv("WATCH_DOCS", "false").lower() == "true"
+WATCH_DEBOUNCE_SECONDS = float(os.getenv("WATCH_DEBOUNCE_SECONDS", "2"))
+WATCH_POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "5"))
 SEARCH_RESULTS = int(os.getenv("SEARCH_RESULTS", "5"))
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3072"))
+PROMPT_CONTEXT_SHARE = float(os.getenv("PROMPT_CONTEXT_SHARE", "0.6"))
+CHARS_PER_TOKEN = int(os.getenv("CHARS_PER_TOKEN", "4"))
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "256"))
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "600"))
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama2")
 
@@ -26,10 +57,53 @@ if not OLLAMA_MODEL:
     logger.warning("OLLAMA_MODEL is not set! Using default: llama2")
     OLLAMA_MODEL = "llama2"
 
+# Ollama connection pool settings
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "10"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+
+# Ollama session context reuse settings
+OLLAMA_REUSE_CONTEXT = os.getenv("OLLAMA_REUSE_CONTEXT", "true").lower() == "true"
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_SESSION_CACHE_SIZE = int(os.getenv("OLLAMA_SESSION_CACHE_SIZE", "256"))
+OLLAMA_SESSION_CONTEXT_MAX_TOKENS = int(
+    os.getenv("OLLAMA_SESSION_CONTEXT_MAX_TOKENS", "4096")
+)
+
+# Conversation storage ("memory" for a single process, "sqlite" to share
+# sessions between worker processes on one host)
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory").lower()
+CONVERSATION_DB_PATH = os.getenv(
+    "CONVERSATION_DB_PATH", os.path.join(DB_DIR, "conversations.sqlite3")
+)
+CONVERSATION_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_FLUSH_INTERVAL", "0.05"))
+
+# Conversation memory limits
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "86400"))
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "200"))
+CONVERSATION_MAX_BYTES = int(os.getenv("CONVERSATION_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Conversation summarization settings
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", OLLAMA_MODEL)
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))
+SUMMARY_MIN_NEW_MESSAGES = int(os.getenv("SUMMARY_MIN_NEW_MESSAGES", "4"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "512"))
+
 # Ollama embedding settings
 USE_OLLAMA_EMBEDDINGS = os.getenv("USE_OLLAMA_EMBEDDINGS", "true").lower() == "true"
 OLLAMA_EMBEDDING_BATCH_SIZE = int(os.getenv("OLLAMA_EMBEDDING_BATCH_SIZE", "10"))
 OLLAMA_EMBEDDING_MODEL = os.getenv("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text")
+OLLAMA_EMBEDDING_CONCURRENCY = int(os.getenv("OLLAMA_EMBEDDING_CONCURRENCY", "1"))
+
+# Embedding cache settings
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_PATH = os.getenv(
+    "EMBEDDING_CACHE_PATH", os.path.join(DB_DIR, "embedding_cache.sqlite3")
+)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
 
 # Application settings
 PORT = int(os.getenv("PORT", "5000"))
@@ -0,0 +1,189 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+VALID_EXTENSIONS = (".txt", ".md", ".yaml", ".yml")
+
+TRACKING_FILE = ".doc_tracking.json"
+
+
+class DocumentCatalog:
+    """
+    Shared, cached listing of the documents in DOCS_DIR.
+
+    Built with os.scandir and refreshed incrementally: a directory whose
+    mtime hasn't changed has the same entries, so only its known files are
+    re-stat'ed instead of listing it again. Refreshes within `ttl` seconds
+    of the last one are served from the cache. The tracking file is
+    rewritten atomically, and only when a document was added, removed or
+    changed.
+    """
+
+    def __init__(self, docs_dir, ttl=None):
+        """
+        Initialize the catalog.
+
+        Args:
+            docs_dir (str): Documentation directory
+            ttl (float): Seconds a refresh stays fresh (defaults to CATALOG_TTL)
+        """
+        self.docs_dir = docs_dir
+        self.ttl = config.CATALOG_TTL if ttl is None else ttl
+        self.tracking_path = os.path.join(docs_dir, TRACKING_FILE)
+        self.refreshes = 0
+        self.directories_listed = 0
+        self._dirs = {}
+        self._files = {}
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Make the next read refresh, e.g. after a document was written"""
+        with self._lock:
+            self._refreshed_at = 0.0
+
+    def _list_directory(self, path):
+        """List a directory, returning (mtime_ns, subdirectories, {name: stat})"""
+        subdirs, files = [], {}
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.name.endswith(VALID_EXTENSIONS):
+                        files[entry.name] = entry.stat()
+                except OSError as e:
+                    logger.warning(f"🟡 Can't stat {entry.path}: {e}")
+        self.directories_listed += 1
+        return os.stat(path).st_mtime_ns, subdirs, files
+
+    def refresh(self, force=False):
+        """
+        Bring the catalog up to date with the filesystem.
+
+        Args:
+            force (bool): Refresh even if the last refresh is within the TTL
+        """
+        with self._lock:
+            if not force and time.time() - self._refreshed_at < self.ttl:
+                return
+
+            os.makedirs(self.docs_dir, exist_ok=True)
+            dirs, files = {}, {}
+            stack = [self.docs_dir]
+            while stack:
+                path = stack.pop()
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                    cached = self._dirs.get(path)
+                    if cached and cached[0] == mtime_ns:
+                        # Same entries as last time; only re-stat the files
+                        subdirs, names = cached[1], cached[2]
+                        stats = {}
+                        for name in names:
+                            try:
+                                stats[name] = os.stat(os.path.join(path, name))
+                            except FileNotFoundError:
+                                pass
+                    else:
+                        mtime_ns, subdirs, stats = self._list_directory(path)
+                except OSError as e:
+                    logger.warning(f"🟡 Can't scan {path}: {e}")
+                    continue
+
+                dirs[path] = (mtime_ns, subdirs, list(stats))
+                stack.extend(subdirs)
+                for name, stat in stats.items():
+                    abs_path = os.path.join(path, name)
+                    rel_path = os.path.relpath(abs_path, self.docs_dir)
+                    files[rel_path] = {
+                        "name": name,
+                        "path": rel_path,
+                        "abs_path": abs_path,
+                        "mtime": stat.st_mtime,
+                        "size": stat.st_size,
+                    }
+
+            changed = files.keys() != self._files.keys() or any(
+                (info["mtime"], info["size"])
+                != (self._files[rel_path]["mtime"], self._files[rel_path]["size"])
+                for rel_path, info in files.items()
+            )
+            self._dirs, self._files = dirs, files
+            self._refreshed_at = time.time()
+            self.refreshes += 1
+            if changed:
+                self._save_tracking()
+
+    def _save_tracking(self):
+        """Write the tracking file atomically"""
+        data = {
+            rel_path: {
+                "mtime": info["mtime"],
+                "size": info["size"],
+                "id": hashlib.md5(info["abs_path"].encode()).hexdigest(),
+            }
+            for rel_path, info in self._files.items()
+        }
+        tmp_path = f"{self.tracking_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp_path, self.tracking_path)
+        except Exception as e:
+            logger.error(f"🔴 Error saving tracking data: {e}")
+
+    def documents(self):
+        """Get all documents, sorted by path"""
+        self.refresh()
+        with self._lock:
+            return [self._files[rel_path] for rel_path in sorted(self._files)]
+
+    def get(self, rel_path):
+        """Get a document by path relative to DOCS_DIR, or None"""
+        self.refresh()
+        with self._lock:
+            return self._files.get(os.path.normpath(rel_path))
+
+    def __contains__(self, rel_path):
+        return self.get(rel_path) is not None
+
+    def get_stats(self):
+        """Get catalog counters as a dictionary"""
+        with self._lock:
+            return {
+                "documents": len(self._files),
+                "directories": len(self._dirs),
+                "refreshes": self.refreshes,
+                "directories_listed": self.directories_listed,
+            }
+
+
+# Shared catalogs, one per documentation directory
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(docs_dir=None):
+    """
+    Get the shared catalog for a documentation directory.
+
+    Args:
+        docs_dir (str): Documentation directory (defaults to DOCS_DIR)
+
+    Returns:
+        DocumentCatalog: The shared catalog
+    """
+    docs_dir = docs_dir or config.DOCS_DIR
+    with _catalogs_lock:
+        if docs_dir not in _catalogs:
+            _catalogs[docs_dir] = DocumentCatalog(docs_dir)
+        return _catalogs[docs_dir]
@@ -29,9 +29,7 @@ class ChromaDBStatus:
     def update_document_count(self, collection):
         """Update the document count from the collection"""
         try:
-            all_docs = collection.get()
-            if all_docs and "ids" in all_docs:
-                self.document_count = len(all_docs["ids"])
+            self.document_count = collection.count()
         except Exception as e:
             logger.error(f"🔴 Error updating document count: {e}")
 
@@ -56,6 +54,34 @@ class ChromaDBStatus:
 # Global status tracker
 db_status = ChromaDBStatus()
 
+# Shared embedding cache (None when disabled or unavailable)
+embedding_cache = None
+
+# Embedding function attached to the collection, used to embed queries directly
+active_embedding_function = None
+
+
+def _with_embedding_cache(emb_fn, model_name):
+    """Wrap an embedding function with the persistent embedding cache if enabled"""
+    global embedding_cache
+
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return emb_fn
+
+    try:
+        from modules.embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+
+        if embedding_cache is None:
+            embedding_cache = EmbeddingCache(
+                config.EMBEDDING_CACHE_PATH,
+                max_entries=config.EMBEDDING_CACHE_MAX_ENTRIES,
+            )
+        return CachedEmbeddingFunction(emb_fn, embedding_cache, model_name)
+    except Exception as e:
+        logger.error(f"🔴 Error setting up embedding cache: {e}")
+        logger.warning("🟡 Continuing without embedding cache")
+        return emb_fn
+
 
 def get_embedding_function():
     """Get the appropriate embedding function based on configuration"""
@@ -72,11 +98,14 @@ def get_embedding_function():
                 emb_fn = OllamaEmbeddingFunction(
                     ollama_base_url=config.OLLAMA_HOST,
                     model_name=config.OLLAMA_EMBEDDING_MODEL,  # Use dedicated embedding model
+                    batch_size=config.OLLAMA_EMBEDDING_BATCH_SIZE,
+                    concurrency=config.OLLAMA_EMBEDDING_CONCURRENCY,
                 )
                 logger.info(
                     f"🟢 Using Ollama for embeddings: {config.OLLAMA_HOST} with model {config.OLLAMA_EMBEDDING_MODEL}"
                 )
-                return emb_fn
+                return _with_embedding_cache(
+                    emb_fn, f"ollama:{config.OLLAMA_EMBEDDING_MODEL}")
             except Exception as e:
                 logger.error(
                     f"🔴 Error setting up Ollama embedding function: {e}")
@@ -95,7 +124,8 @@ def get_embedding_function():
                 model_name="all-mpnet-base-v2"
             )
             logger.info("🟡 Using local SentenceTransformer for embeddings")
-            return emb_fn
+            return _with_embedding_cache(
+                emb_fn, "sentence-transformers:all-mpnet-base-v2")
 
     except Exception as e:
         logger.error(f"🔴 Error getting embedding function: {e}")
@@ -105,6 +135,8 @@ def get_embedding_function():
 
 def init_db():
     """Initialize ChromaDB"""
+    global active_embedding_function
+
     if not config.CHROMA_AVAILABLE:
         logger.warning(
             "🔴 ChromaDB not available. Vector search will be disabled.")
@@ -138,6 +170,7 @@ def init_db():
 
                 # Get the embedding function
                 emb_fn = get_embedding_function()
+                active_embedding_function = emb_fn
 
                 # Try to get existing collection or create new one
                 try:
@@ -185,13 +218,13 @@ def init_db():
         return None, None
 
 
-def query_with_timing(collection, query_texts, n_results=5, **kwargs):
+def query_with_timing(collection, query_texts=None, n_results=5, **kwargs):
     """
     Query the collection with timing information.
 
     Args:
         collection: ChromaDB collection
-        query_texts: Text to query
+        query_texts: Text to query (omit when passing query_embeddings)
         n_results: Number of results to return
         **kwargs: Additional arguments to pass to collection.query
 
@@ -203,9 +236,9 @@ def query_with_timing(collection, query_texts, n_results=5, **kwargs):
 
     start_time = time.time()
     try:
-        results = collection.query(
-            query_texts=query_texts, n_results=n_results, **kwargs
-        )
+        if query_texts is not None:
+            kwargs["query_texts"] = query_texts
+        results = collection.query(n_results=n_results, **kwargs)
         elapsed = time.time() - start_time
         db_status.record_query_time(elapsed)
         logger.debug(f"Query completed in {elapsed:.4f}s")
@@ -1,14 +1,556 @@
-from collections import defaultdict
+import os
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class _Session:
+    """Messages and running summary for one conversation"""
+
+    __slots__ = ("messages", "summary", "bytes", "last_access", "offset")
+
+    def __init__(self):
+        self.messages = []
+        self.summary = None
+        self.bytes = 0
+        self.last_access = time.time()
+        # Number of older messages trimmed from the front
+        self.offset = 0
+
+
+class _Stripe:
+    """One lock-protected shard of the session table, kept in LRU order"""
+
+    __slots__ = ("lock", "sessions", "bytes")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = OrderedDict()
+        self.bytes = 0
+
+
+def _message_size(content):
+    """Approximate memory cost of a message, in bytes"""
+    return len(content.encode("utf-8")) if content else 0
 
 
 class ConversationTracker:
     """
     Tracks conversation history between users and the assistant.
     Each conversation is identified by a unique session_id.
+
+    Sessions are spread over lock-striped shards so concurrent requests for
+    different sessions don't contend. Memory is bounded: idle sessions expire
+    after a TTL, each session keeps at most max_messages, and least recently
+    used sessions are evicted to stay within max_sessions and max_bytes.
+    Session and byte totals are counted across all stripes, so the limits
+    hold for the tracker as a whole.
     """
 
-    def __init__(self):
-        self.conversations = defaultdict(list)
+    STRIPES = 16
+    # Seconds between sweeps of every stripe for expired sessions
+    SWEEP_INTERVAL = 60
+
+    def __init__(
+        self, max_sessions=1000, session_ttl=86400, max_messages=200, max_bytes=64 * 1024 * 1024
+    ):
+        """
+        Initialize the conversation tracker.
+
+        Args:
+            max_sessions (int): Maximum number of sessions kept in memory
+            session_ttl (float): Seconds of inactivity before a session expires
+            max_messages (int): Maximum number of messages kept per session
+            max_bytes (int): Approximate memory budget for all message content
+        """
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self._stripes = [_Stripe() for _ in range(self.STRIPES)]
+        self._counter_lock = threading.Lock()
+        # Totals across all stripes, guarded by _counter_lock
+        self._total_sessions = 0
+        self._total_bytes = 0
+        # Serializes evictions so concurrent requests don't evict twice
+        self._evict_lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.evictions = {"ttl": 0, "lru": 0, "bytes": 0}
+        self.trimmed_messages = 0
+
+    def _stripe(self, session_id):
+        return self._stripes[hash(session_id) % self.STRIPES]
+
+    def _count(self, key, amount=1):
+        with self._counter_lock:
+            if key == "trimmed":
+                self.trimmed_messages += amount
+            else:
+                self.evictions[key] += amount
+
+    def _account(self, sessions=0, size=0):
+        """Adjust the global session and byte totals"""
+        with self._counter_lock:
+            self._total_sessions += sessions
+            self._total_bytes += size
+
+    def _get_session(self, stripe, session_id, create=False):
+        """Look up a session, expiring it if idle too long (stripe lock held)"""
+        now = time.time()
+        session = stripe.sessions.get(session_id)
+        if session and now - session.last_access > self.session_ttl:
+            self._drop(stripe, session_id)
+            self._count("ttl")
+            session = None
+        if session is None:
+            if not create:
+                return None
+            session = _Session()
+            stripe.sessions[session_id] = session
+            self._account(sessions=1)
+        session.last_access = now
+        stripe.sessions.move_to_end(session_id)
+        return session
+
+    def _drop(self, stripe, session_id):
+        session = stripe.sessions.pop(session_id)
+        stripe.bytes -= session.bytes
+        self._account(sessions=-1, size=-session.bytes)
+
+    def _trim_session(self, stripe, session):
+        """Drop a session's oldest messages beyond the per-session cap"""
+        excess = len(session.messages) - self.max_messages
+        if excess <= 0:
+            return
+        size = sum(_message_size(msg["content"]) for msg in session.messages[:excess])
+        session.bytes -= size
+        stripe.bytes -= size
+        self._account(size=-size)
+        del session.messages[:excess]
+        session.offset += excess
+        if session.summary:
+            # Keep the summary's message_count pointing at the same messages
+            session.summary["message_count"] = max(
+                session.summary["message_count"] - excess, 0
+            )
+        self._count("trimmed", excess)
+
+    def _expire(self, stripe, keep_session_id):
+        """Drop a stripe's expired sessions (stripe lock held)"""
+        now = time.time()
+        # Sessions are in access order, so expired ones are at the front
+        while stripe.sessions:
+            session_id, session = next(iter(stripe.sessions.items()))
+            if session_id == keep_session_id or now - session.last_access <= self.session_ttl:
+                break
+            self._drop(stripe, session_id)
+            self._count("ttl")
+
+    def _sweep_expired(self):
+        """
+        Expire idle sessions in every stripe, at most once per
+        SWEEP_INTERVAL. Accesses only expire sessions in their own stripe,
+        so without this idle sessions elsewhere would linger until LRU
+        pressure removed them, and still be counted in the stats.
+        """
+        now = time.time()
+        with self._counter_lock:
+            if now - self._last_sweep < min(self.SWEEP_INTERVAL, self.session_ttl):
+                return
+            self._last_sweep = now
+        for stripe in self._stripes:
+            with stripe.lock:
+                self._expire(stripe, None)
+
+    def _over_limit(self):
+        """The eviction reason if a global limit is exceeded, else None"""
+        with self._counter_lock:
+            if self._total_sessions > self.max_sessions:
+                return "lru"
+            if self._total_bytes > self.max_bytes and self._total_sessions > 1:
+                return "bytes"
+            return None
+
+    def _evict_oldest(self, keep_session_id, reason):
+        """
+        Drop the least recently used session across all stripes.
+
+        Stripe locks are taken one at a time, never nested, so this can't
+        deadlock with requests on other stripes.
+
+        Returns:
+            bool: False if there was no session to evict
+        """
+        oldest = None
+        for stripe in self._stripes:
+            with stripe.lock:
+                for session_id, session in stripe.sessions.items():
+                    if session_id == keep_session_id:
+                        continue
+                    if oldest is None or session.last_access < oldest[2]:
+                        oldest = (stripe, session_id, session.last_access)
+                    break
+        if oldest is None:
+            return False
+        stripe, session_id, last_access = oldest
+        with stripe.lock:
+            session = stripe.sessions.get(session_id)
+            # Skip it if it was used or dropped since it was picked
+            if session is not None and session.last_access == last_access:
+                self._drop(stripe, session_id)
+                self._count(reason)
+        return True
+
+    def _enforce_limits(self, keep_session_id):
+        """Evict least recently used sessions until the global limits hold"""
+        if self._over_limit() is None:
+            return
+        with self._evict_lock:
+            while True:
+                reason = self._over_limit()
+                if reason is None or not self._evict_oldest(keep_session_id, reason):
+                    break
+
+    def add_message(self, session_id, role, content):
+        """
+        Add a message to the conversation history.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+            role (str): Either 'user' or 'assistant'
+            content (str): The message content
+        """
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._get_session(stripe, session_id, create=True)
+            session.messages.append({"role": role, "content": content})
+            size = _message_size(content)
+            session.bytes += size
+            stripe.bytes += size
+            self._account(size=size)
+            self._trim_session(stripe, session)
+            self._expire(stripe, session_id)
+        self._enforce_limits(session_id)
+        self._sweep_expired()
+
+    def get_conversation(self, session_id):
+        """
+        Get the full conversation history for a session.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+
+        Returns:
+            list: List of message dictionaries with 'role' and 'content' keys
+        """
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._get_session(stripe, session_id)
+            return list(session.messages) if session else []
+
+    def get_summary(self, session_id):
+        """
+        Get the running summary of older turns for a session.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+
+        Returns:
+            dict: {'text': summary, 'message_count': messages folded in}, or None
+        """
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._get_session(stripe, session_id)
+            return dict(session.summary) if session and session.summary else None
+
+    def get_snapshot(self, session_id):
+        """
+        Read a session's history and summary together.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+
+        Returns:
+            tuple: (messages, offset, summary), where offset is the number of
+            older messages already trimmed before the first one returned
+        """
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._get_session(stripe, session_id)
+            if session is None:
+                return [], 0, None
+            summary = dict(session.summary) if session.summary else None
+            return list(session.messages), session.offset, summary
+
+    def set_summary(self, session_id, text, message_count, offset=None):
+        """
+        Store the running summary for a session.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+            text (str): Summary of the first message_count messages
+            message_count (int): Number of messages the summary covers
+            offset (int): Offset from get_snapshot that message_count counts
+                from, so messages trimmed since then are allowed for (optional)
+        """
+        stripe = self._stripe(session_id)
+        with stripe.lock:
+            session = self._get_session(stripe, session_id)
+            if session is None:
+                return
+            if offset is not None:
+                message_count = max(message_count + offset - session.offset, 0)
+            old_size = _message_size(
+                session.summary["text"]) if session.summary else 0
+            session.summary = {"text": text, "message_count": message_count}
+            delta = _message_size(text) - old_size
+            session.bytes += delta
+            stripe.bytes += delta
+            self._account(size=delta)
+
+    def get_stats(self):
+        """Get tracker counters as a dictionary"""
+        self._sweep_expired()
+        sessions = messages = total_bytes = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                sessions += len(stripe.sessions)
+                messages += sum(len(s.messages)
+                                for s in stripe.sessions.values())
+                total_bytes += stripe.bytes
+        return {
+            "sessions": sessions,
+            "messages": messages,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "backend": "memory",
+            "evictions": dict(self.evictions),
+            "trimmed_messages": self.trimmed_messages,
+        }
+
+
+class SQLiteConversationTracker:
+    """
+    Conversation tracker backed by a SQLite database in WAL mode, so several
+    worker processes on one host can share sessions.
+
+    Messages are append-only rows. Each process loads a session lazily the
+    first time it is seen and afterwards only reads rows newer than the ones
+    it already has. New messages go into a small write-behind buffer that a
+    background thread flushes every flush_interval seconds (or once
+    flush_batch messages are waiting); reads in the same process always see
+    their own buffered writes.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_sessions=1000,
+        session_ttl=86400,
+        max_messages=200,
+        flush_interval=0.05,
+        flush_batch=32,
+    ):
+        """
+        Initialize the SQLite conversation tracker.
+
+        Args:
+            path (str): Path of the SQLite database file
+            max_sessions (int): Maximum number of sessions cached in this process
+            session_ttl (float): Seconds of inactivity before a session is deleted
+            max_messages (int): Maximum number of messages returned per session
+            flush_interval (float): Seconds between write-behind flushes
+            flush_batch (int): Buffered messages that trigger an immediate flush
+        """
+        import sqlite3
+
+        self.path = path
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.max_messages = max_messages
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.flushes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._flush_event = threading.Event()
+        # session_id -> {"messages": [...], "last_id": int, "total": int}
+        self._cache = OrderedDict()
+        # Buffered (session_id, role, content, created) rows not yet written
+        self._pending = []
+        self._last_prune = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                last_active REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions (last_active);
+            CREATE TABLE IF NOT EXISTS summaries (
+                session_id TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                message_count INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn.commit()
+
+        self._thread = threading.Thread(
+            target=self._flush_loop, name="conversation-flush", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.flush)
+
+        logger.info(f"🟢 SQLite conversation store opened at {path}")
+
+    def _flush_loop(self):
+        """Background write-behind loop"""
+        while True:
+            self._flush_event.wait(self.flush_interval)
+            self._flush_event.clear()
+            try:
+                self.flush()
+                if time.time() - self._last_prune > 60:
+                    self._prune_expired()
+            except Exception as e:
+                logger.error(f"🔴 Error flushing conversation store: {e}")
+
+    def flush(self):
+        """Write all buffered messages to the database"""
+        with self._lock:
+            if not self._pending:
+                return
+            rows = self._pending
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO messages (session_id, role, content, created) VALUES (?, ?, ?, ?)",
+                    rows,
+                )
+                counts = {}
+                for session_id, _, _, created in rows:
+                    count, _ = counts.get(session_id, (0, 0))
+                    counts[session_id] = (count + 1, created)
+                self._conn.executemany(
+                    """
+                    INSERT INTO sessions (session_id, message_count, last_active) VALUES (?, ?, ?)
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        message_count = message_count + excluded.message_count,
+                        last_active = excluded.last_active
+                    """,
+                    [(sid, count, created)
+                     for sid, (count, created) in counts.items()],
+                )
+            self._pending = []
+            self.flushes += 1
+
+    def _prune_expired(self):
+        """Delete sessions idle for longer than the TTL"""
+        self._last_prune = time.time()
+        cutoff = self._last_prune - self.session_ttl
+        with self._lock, self._conn:
+            expired = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT session_id FROM sessions WHERE last_active < ?", (
+                        cutoff,)
+                )
+            ]
+            for session_id in expired:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ?", (session_id,))
+                self._conn.execute(
+                    "DELETE FROM summaries WHERE session_id = ?", (session_id,))
+                self._conn.execute(
+                    "DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                self._cache.pop(session_id, None)
+        if expired:
+            logger.info(
+                f"🟡 Deleted {len(expired)} expired conversation sessions")
+
+    def _load(self, session_id):
+        """
+        Bring the cached copy of a session up to date (lock held).
+
+        The first load reads only the latest max_messages rows; later loads
+        read just the rows appended since, by this or any other process.
+        """
+        entry = self._cache.get(session_id)
+        # One read transaction, so the rows and the total come from the same
+        # snapshot even while another process is appending
+        self._conn.execute("BEGIN")
+        try:
+            if entry is None:
+                rows = self._conn.execute(
+                    "SELECT id, role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+                    (session_id, self.max_messages),
+                ).fetchall()
+                rows.reverse()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id, role, content FROM messages WHERE session_id = ? AND id > ? ORDER BY id",
+                    (session_id, entry["last_id"]),
+                ).fetchall()
+            row = self._conn.execute(
+                "SELECT message_count FROM sessions WHERE session_id = ?", (
+                    session_id,)
+            ).fetchone()
+        finally:
+            self._conn.commit()
+
+        if entry is None:
+            entry = {"messages": [], "last_id": 0}
+            self._cache[session_id] = entry
+            while len(self._cache) > self.max_sessions:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        self._cache.move_to_end(session_id)
+
+        for row_id, role, content in rows:
+            entry["messages"].append({"role": role, "content": content})
+            entry["last_id"] = row_id
+        if len(entry["messages"]) > self.max_messages:
+            del entry["messages"][: len(entry["messages"]) - self.max_messages]
+
+        entry["total"] = row[0] if row else 0
+        return entry
+
+    def _window(self, session_id):
+        """
+        Messages for a session including buffered ones, and the absolute
+        index of the first returned message (lock held).
+        """
+        entry = self._load(session_id)
+        pending = [
+            {"role": role, "content": content}
+            for sid, role, content, _ in self._pending
+            if sid == session_id
+        ]
+        messages = (entry["messages"] + pending)[-self.max_messages:]
+        offset = entry["total"] + len(pending) - len(messages)
+        return messages, offset
 
     def add_message(self, session_id, role, content):
         """
@@ -19,8 +561,11 @@ class ConversationTracker:
             role (str): Either 'user' or 'assistant'
             content (str): The message content
         """
-        self.conversations[session_id].append(
-            {"role": role, "content": content})
+        with self._lock:
+            self._pending.append((session_id, role, content, time.time()))
+            waiting = len(self._pending)
+        if waiting >= self.flush_batch:
+            self._flush_event.set()
 
     def get_conversation(self, session_id):
         """
@@ -32,4 +577,110 @@ class ConversationTracker:
         Returns:
             list: List of message dictionaries with 'role' and 'content' keys
         """
-        return self.conversations[session_id]
+        with self._lock:
+            messages, _ = self._window(session_id)
+            return messages
+
+    def get_summary(self, session_id):
+        """
+        Get the running summary of older turns for a session.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+
+        Returns:
+            dict: {'text': summary, 'message_count': messages folded in}, or None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, message_count FROM summaries WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if not row:
+                return None
+            _, offset = self._window(session_id)
+            # Stored counts are absolute; callers index into the returned window
+            return {"text": row[0], "message_count": max(row[1] - offset, 0)}
+
+    def get_snapshot(self, session_id):
+        """
+        Read a session's history and summary together.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+
+        Returns:
+            tuple: (messages, offset, summary), where offset is the absolute
+            index of the first message returned
+        """
+        with self._lock:
+            messages, offset = self._window(session_id)
+            row = self._conn.execute(
+                "SELECT text, message_count FROM summaries WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+            summary = (
+                {"text": row[0], "message_count": max(row[1] - offset, 0)} if row else None
+            )
+            return messages, offset, summary
+
+    def set_summary(self, session_id, text, message_count, offset=None):
+        """
+        Store the running summary for a session.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+            text (str): Summary of the first message_count messages
+            message_count (int): Number of messages the summary covers
+            offset (int): Offset from get_snapshot that message_count counts
+                from, so messages trimmed since then are allowed for (optional)
+        """
+        with self._lock:
+            if offset is None:
+                _, offset = self._window(session_id)
+            with self._conn:
+                self._conn.execute(
+                    """
+                    INSERT INTO summaries (session_id, text, message_count) VALUES (?, ?, ?)
+                    ON CONFLICT(session_id) DO UPDATE SET
+                        text = excluded.text, message_count = excluded.message_count
+                    """,
+                    (session_id, text, message_count + offset),
+                )
+
+    def get_stats(self):
+        """Get tracker counters as a dictionary"""
+        with self._lock:
+            sessions = self._conn.execute(
+                "SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {
+                "backend": "sqlite",
+                "sessions": sessions,
+                "cached_sessions": len(self._cache),
+                "pending_messages": len(self._pending),
+                "flushes": self.flushes,
+                "evictions": {"lru": self.evictions},
+            }
+
+
+def create_conversation_tracker():
+    """Create the conversation tracker selected by CONVERSATION_BACKEND"""
+    if config.CONVERSATION_BACKEND == "sqlite":
+        try:
+            return SQLiteConversationTracker(
+                config.CONVERSATION_DB_PATH,
+                max_sessions=config.CONVERSATION_MAX_SESSIONS,
+                session_ttl=config.CONVERSATION_TTL,
+                max_messages=config.CONVERSATION_MAX_MESSAGES,
+                flush_interval=config.CONVERSATION_FLUSH_INTERVAL,
+            )
+        except Exception as e:
+            logger.error(f"🔴 Error opening SQLite conversation store: {e}")
+            logger.warning("🟡 Falling back to in-memory conversation tracker")
+
+    return ConversationTracker(
+        max_sessions=config.CONVERSATION_MAX_SESSIONS,
+        session_ttl=config.CONVERSATION_TTL,
+        max_messages=config.CONVERSATION_MAX_MESSAGES,
+        max_bytes=config.CONVERSATION_MAX_BYTES,
+    )
@@ -1,120 +1,100 @@
 import os
-import json
 import yaml
 import re
 import hashlib
 import logging
 from datetime import datetime
 import config
-from modules.utils import split_into_chunks
+from modules.manifest import get_manifest
+from modules.catalog import get_catalog
+from modules.lexical_index import get_lexical_index
+from modules.indexing_pipeline import IndexingPipeline
+from modules.utils import ID_BATCH_SIZE, sources_metadata
+from modules import chromadb_handler
 
 logger = logging.getLogger(__name__)
 
 
+def file_hash(file_path):
+    """SHA-256 of a document's text, as recorded in the index manifest"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        return hashlib.sha256(f.read().encode("utf-8")).hexdigest()
+
+
 def get_document_status(docs_dir, collection, chroma_available):
     """
     Get status of all documents.
     Returns a dict with indexed, unindexed, modified, and needs_indexing keys.
     """
-    os.makedirs(docs_dir, exist_ok=True)
-    tracking_file = os.path.join(docs_dir, ".doc_tracking.json")
-    try:
-        with open(tracking_file, "r", encoding="utf-8") as f:
-            tracking_data = json.load(f)
-    except Exception as e:
-        logger.error(f"🔴 Error loading tracking data: {e}")
-        tracking_data = {}
-
-    valid_ext = (".txt", ".md", ".yaml", ".yml")
-    doc_files = [
-        os.path.join(root, file)
-        for root, _, files in os.walk(docs_dir)
-        for file in files
-        if not file.startswith(".") and file.endswith(valid_ext)
-    ]
-
     indexed_files, unindexed_files, modified_files = [], [], []
-    new_tracking_data = {}
 
-    # Get all indexed document sources from ChromaDB
-    indexed_sources = set()
+    # What has been indexed comes from the manifest, not from ChromaDB
+    manifest = None
     if chroma_available and collection is not None:
+        manifest = get_manifest(collection, docs_dir)
+
+    # First pass: resolve what we can from the catalog and the manifest
+    file_states = []
+    for info in get_catalog(docs_dir).documents():
+        rel_path = info["path"]
+        file_id = hashlib.md5(info["abs_path"].encode()).hexdigest()
+        entry = manifest.get(rel_path) if manifest else None
+        file_states.append(
+            (rel_path, file_id, info["mtime"], info["size"], entry))
+
+    # Files missing from the manifest may still have been indexed under the
+    # old ID scheme; check all of them with one bulk lookup
+    legacy_ids = set()
+    unknown = [state for state in file_states if state[4] is None]
+    if unknown and manifest is not None:
+        candidate_ids = [
+            candidate
+            for _, file_id, _, _, _ in unknown
+            for candidate in (file_id, f"{file_id}_0")
+        ]
         try:
-            # Get all documents and their metadata
-            all_docs = collection.get()
-            if all_docs and "metadatas" in all_docs and all_docs["metadatas"]:
-                for metadata in all_docs["metadatas"]:
-                    if metadata and "source" in metadata:
-                        # Normalize the path to handle different path formats
-                        normalized_path = os.path.normpath(metadata["source"])
-                        indexed_sources.add(normalized_path)
-
-                        # Also add the relative path version
-                        try:
-                            rel_path = os.path.relpath(
-                                normalized_path, docs_dir)
-                            indexed_sources.add(
-                                os.path.join(docs_dir, rel_path))
-                        except ValueError:
-                            pass
+            # Batched only to stay under SQLite's bound-parameter limit
+            for i in range(0, len(candidate_ids), ID_BATCH_SIZE):
+                results = collection.get(
+                    ids=candidate_ids[i: i + ID_BATCH_SIZE], include=[])
+                legacy_ids.update(results.get("ids") or [])
         except Exception as e:
-            logger.error(f"🔴 Error fetching sources from ChromaDB: {e}")
+            logger.error(f"🔴 Error checking unindexed files by ID: {e}")
 
-    for file_path in doc_files:
-        rel_path = os.path.relpath(file_path, docs_dir)
-        abs_path = os.path.abspath(file_path)
-        normalized_path = os.path.normpath(file_path)
-        file_id = hashlib.md5(file_path.encode()).hexdigest()
-
-        try:
-            mtime = os.path.getmtime(file_path)
-            size = os.path.getsize(file_path)
-            file_info = {"mtime": mtime, "size": size, "id": file_id}
-            new_tracking_data[rel_path] = file_info
-
-            # Check if this file is indexed using multiple path formats
-            is_indexed = (
-                file_path in indexed_sources
-                or abs_path in indexed_sources
-                or normalized_path in indexed_sources
-            )
-
-            # If not found by path, try the old ID-based approach as fallback
-            if not is_indexed and chroma_available and collection is not None:
-                try:
-                    # Try with both formats: with and without chunk suffix
-                    results = collection.get(ids=[file_id])
-                    is_indexed = bool(results.get("ids"))
-
-                    if not is_indexed:
-                        results = collection.get(ids=[file_id + "_0"])
-                        is_indexed = bool(results.get("ids"))
-                except Exception as e:
-                    logger.error(f"🔴 Error checking {file_path} by ID: {e}")
+    for rel_path, file_id, mtime, size, entry in file_states:
+        is_indexed = (
+            entry is not None
+            or file_id in legacy_ids
+            or f"{file_id}_0" in legacy_ids
+        )
 
-            # Log the result for debugging
-            logger.info(f"🟢 File {rel_path}: indexed={is_indexed}")
+        # Compare against the file as it was when it was indexed. A changed
+        # mtime or size is only a hint; the content hash decides
+        is_modified = entry is not None and (
+            entry["mtime"] != mtime
+            or (entry["size"] is not None and entry["size"] != size)
+        )
+        if is_modified and entry.get("hash"):
+            try:
+                is_modified = file_hash(
+                    os.path.join(docs_dir, rel_path)) != entry["hash"]
+                if not is_modified:
+                    manifest.touch(rel_path, mtime, size)
+            except Exception as e:
+                logger.error(f"🔴 Error hashing file {rel_path}: {e}")
 
-            is_modified = rel_path in tracking_data and (
-                tracking_data[rel_path]["mtime"] != mtime
-                or tracking_data[rel_path]["size"] != size
-            )
+        logger.debug(
+            f"File {rel_path}: indexed={is_indexed} modified={is_modified}")
 
-            if is_indexed and not is_modified:
-                indexed_files.append(rel_path)
-            elif is_indexed and is_modified:
-                modified_files.append(rel_path)
-            else:
-                unindexed_files.append(rel_path)
-        except Exception as e:
-            logger.error(f"🔴 Error processing file {file_path}: {e}")
+        if is_indexed and not is_modified:
+            indexed_files.append(rel_path)
+        elif is_indexed and is_modified:
+            modified_files.append(rel_path)
+        else:
             unindexed_files.append(rel_path)
 
-    try:
-        with open(tracking_file, "w", encoding="utf-8") as f:
-            json.dump(new_tracking_data, f, indent=2)
-    except Exception as e:
-        logger.error(f"🔴 Error saving tracking data: {e}")
+    if manifest is not None:
+        manifest.save()
 
     # Log the results
     logger.info(
@@ -130,7 +110,11 @@ def get_document_status(docs_dir, collection, chroma_available):
 
 
 def index_documents(
-    collection, docs_dir=config.DOCS_DIR, specific_files=None, force_reindex=False
+    collection,
+    docs_dir=config.DOCS_DIR,
+    specific_files=None,
+    force_reindex=False,
+    job=None,
 ):
     """
     Index documentation files into the vector database.
@@ -140,7 +124,9 @@ def index_documents(
         collection: ChromaDB collection
         docs_dir: Directory containing documentation files
         specific_files: List of specific files to index
-        force_reindex: Whether to force reindexing of all files
+        force_reindex: Whether to rewrite every chunk, of specific_files if
+            given and otherwise of all files
+        job: Background IndexJob to report progress to and check for cancellation
     """
     if not config.CHROMA_AVAILABLE or collection is None:
         return {
@@ -153,13 +139,25 @@ def index_documents(
 
     files_indexed, files_updated, files_skipped = 0, 0, 0
     os.makedirs(docs_dir, exist_ok=True)
+
+    # Drop chunks of documents deleted or moved since the last run; this
+    # also refreshes the catalog, so every change on disk is picked up
+    pruned = prune_index(collection, docs_dir)
     doc_status = get_document_status(
         docs_dir, collection, config.CHROMA_AVAILABLE)
+    manifest = get_manifest(collection, docs_dir)
 
     # Determine which files to process based on parameters
     files_to_process = []
 
-    if force_reindex:
+    if specific_files:
+        # Index only specific files; with force_reindex their chunks are
+        # all rewritten, as when resuming an interrupted forced run
+        catalog = get_catalog(docs_dir)
+        for rel_path in specific_files:
+            if rel_path in catalog:
+                files_to_process.append(os.path.join(docs_dir, rel_path))
+    elif force_reindex:
         # Include all indexed, unindexed, and modified files when force_reindex is True
         logger.info("🟡 Force reindexing all documents")
         for rel_path in (
@@ -167,12 +165,6 @@ def index_documents(
                 doc_status["modified"]
         ):
             files_to_process.append(os.path.join(docs_dir, rel_path))
-    elif specific_files:
-        # Index only specific files
-        for rel_path in specific_files:
-            abs_path = os.path.join(docs_dir, rel_path)
-            if os.path.exists(abs_path):
-                files_to_process.append(abs_path)
     else:
         # Index only unindexed and modified files by default
         for rel_path in doc_status["unindexed"] + doc_status["modified"]:
@@ -181,151 +173,192 @@ def index_documents(
     # Log the number of files to process
     logger.info(f"🟡 Processing {len(files_to_process)} files")
 
+    # Work out what each file replaces here; reading, chunking, embedding
+    # and writing then run as pipeline stages
+    files, update_paths = [], set()
     for file_path in files_to_process:
         try:
             file_path = os.path.normpath(file_path)
-            file_id = hashlib.md5(file_path.encode()).hexdigest()
             rel_path = os.path.relpath(file_path, docs_dir)
 
             # Check if this is a new document or an update
             is_update = rel_path in doc_status["modified"] or (
                 force_reindex and rel_path in doc_status["indexed"]
             )
-
-            # Remove existing document chunks if updating
             if is_update:
+                update_paths.add(rel_path)
+
+            # Find the document's existing chunks; the pipeline deletes the
+            # ones that are no longer needed before any new chunk is written
+            old_ids = None
+            entry = manifest.get(rel_path)
+            if is_update or entry:
                 try:
-                    logger.info(f"🟡 Removing existing chunks for {rel_path}")
-                    results = collection.get(where={"source": file_path})
-                    if results and results["ids"]:
-                        collection.delete(ids=results["ids"])
+                    logger.debug(f"Looking up existing chunks for {rel_path}")
+                    if entry:
+                        old_ids = entry["chunk_ids"]
+                    else:
+                        results = collection.get(
+                            where={"source": file_path}, include=[])
+                        old_ids = results["ids"] if results else []
                 except Exception as e:
                     logger.error(
-                        f"🔴 Error removing old chunks for {file_path}: {e}")
-
-            mtime = str(os.path.getmtime(file_path))
-
-            # Handle text and markdown files
-            if file_path.endswith((".txt", ".md")):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                chunks = split_into_chunks(content)
-                for i, chunk in enumerate(chunks):
-                    chunk_id = f"{file_id}_{i}"
-                    try:
-                        collection.add(
-                            ids=[chunk_id],
-                            documents=[chunk],
-                            metadatas=[
-                                {"source": file_path, "chunk": i, "mtime": mtime}
-                            ],
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"🔴 Error adding chunk {i} from {file_path}: {e}")
-                        continue
-
-            # Handle YAML/YML files
-            elif file_path.endswith((".yaml", ".yml")):
-                with open(file_path, "r", encoding="utf-8") as f:
-                    try:
-                        data = yaml.safe_load(f)
-                        content = json.dumps(data, indent=2)
-                        collection.add(
-                            ids=[file_id],
-                            documents=[content],
-                            metadatas=[
-                                {"source": file_path, "type": "config", "mtime": mtime}
-                            ],
-                        )
-                    except Exception as e:
-                        logger.error(
-                            f"🔴 Error processing YAML file {file_path}: {e}")
-                        continue
-            else:
-                files_skipped += 1
-                continue
-
-            # Update counters based on whether this was an update or new file
-            if is_update:
-                files_updated += 1
-                logger.info(f"Updated file: {rel_path}")
-            else:
-                files_indexed += 1
-                logger.info(f"Indexed file: {rel_path}")
+                        f"🔴 Error looking up old chunks for {file_path}: {e}")
 
+            files.append((file_path, old_ids))
         except Exception as e:
             logger.error(f"Error processing file {file_path}: {e}")
             files_skipped += 1
 
+    if job is not None:
+        job.start([os.path.relpath(path, docs_dir) for path, _ in files])
+
+    # A forced reindex rewrites every chunk; otherwise only chunks whose
+    # content changed are embedded and written
+    pipeline = IndexingPipeline(
+        collection,
+        manifest,
+        chromadb_handler.active_embedding_function,
+        job=job,
+        replace=force_reindex,
+        lexical_index=get_lexical_index(collection),
+    )
+    pipeline_stats = pipeline.run(files, docs_dir)
+
+    # Update counters based on whether each file was an update or new file
+    for rel_path, outcome in pipeline.outcomes.items():
+        if outcome != "indexed":
+            files_skipped += 1
+        elif rel_path in update_paths:
+            files_updated += 1
+            logger.info(f"Updated file: {rel_path}")
+        else:
+            files_indexed += 1
+            logger.info(f"Indexed file: {rel_path}")
+
     # Log the results
     logger.info(
         f"🟢 Indexing completed: {files_indexed} indexed, {files_updated} updated, {files_skipped} skipped"
     )
 
+    if pipeline_stats["error"]:
+        status = "error"
+    elif job is not None and job.cancelled:
+        status = "cancelled"
+    else:
+        status = "success"
     return {
-        "status": "success",
+        "status": status,
+        "error": pipeline_stats["error"],
         "indexed": files_indexed,
         "updated": files_updated,
         "skipped": files_skipped,
+        "chunks_written": pipeline_stats["chunks_written"],
+        "chunks_reused": pipeline_stats["chunks_reused"],
+        "chunks_shared": pipeline_stats["chunks_shared"],
+        "chunks_deleted": pipeline_stats["chunks_deleted"],
+        "chunk_errors": pipeline_stats["chunk_errors"],
+        "pipeline": pipeline_stats["stages"],
+        "pruned": {
+            "documents": len(pruned.get("documents", [])),
+            "chunks": pruned.get("chunks_removed", 0),
+        },
     }
 
 
-def query_vector_db(collection, query, n_results=config.SEARCH_RESULTS):
-    """Search the vector database for relevant context"""
+def prune_index(collection, docs_dir=config.DOCS_DIR):
+    """
+    Remove chunks of documents that no longer exist in the docs directory.
+    The catalog is refreshed first, so a document deleted moments ago is
+    pruned. Run it on the indexing job queue (IndexJobManager.submit_prune)
+    rather than directly, so it never overlaps an indexing run.
+
+    Parameters:
+        collection: ChromaDB collection
+        docs_dir: Directory containing documentation files
+
+    Returns:
+        dict: Status, the documents pruned and the number of chunks removed
+    """
     if not config.CHROMA_AVAILABLE or collection is None:
-        return "Vector search not available. Using default knowledge."
+        return {"status": "error", "error": "ChromaDB not available"}
+
+    manifest = get_manifest(collection, docs_dir)
+    lexical_index = get_lexical_index(collection)
+    catalog = get_catalog(docs_dir)
+    catalog.refresh(force=True)
+    orphaned = [
+        rel_path for rel_path in manifest.paths() if rel_path not in catalog]
+
+    documents_pruned, chunks_removed = [], 0
+    shared = set()
+    for rel_path in orphaned:
+        entry = manifest.get(rel_path)
+        chunk_ids = entry["chunk_ids"] if entry else []
+        # Chunks another document still references are kept
+        unreferenced = [
+            chunk_id for chunk_id in chunk_ids if manifest.referrers(chunk_id) <= {rel_path}
+        ]
+        try:
+            # Batched only to stay under SQLite's bound-parameter limit
+            for i in range(0, len(unreferenced), ID_BATCH_SIZE):
+                collection.delete(ids=unreferenced[i: i + ID_BATCH_SIZE])
+            lexical_index.remove(unreferenced)
+            manifest.remove(rel_path)
+            documents_pruned.append(rel_path)
+            chunks_removed += len(unreferenced)
+            shared.update(set(chunk_ids) - set(unreferenced))
+        except Exception as e:
+            logger.error(f"🔴 Error pruning chunks of {rel_path}: {e}")
+
+    # Drop the pruned documents from the sources of the chunks they shared
+    updates = []
+    for chunk_id in sorted(shared):
+        refs = manifest.referrers(chunk_id)
+        if refs:
+            updates.append((chunk_id, sources_metadata(
+                sorted(manifest.get(rel_path)["source"] for rel_path in refs))))
     try:
-        # Set include parameter to fetch all relevant metadata but avoid adding new vectors
-        results = collection.query(
-            query_texts=[query],
-            n_results=n_results,
-            include=["documents", "metadatas", "distances"],
+        for i in range(0, len(updates), ID_BATCH_SIZE):
+            ids, metadatas = zip(*updates[i: i + ID_BATCH_SIZE])
+            collection.update(ids=list(ids), metadatas=list(metadatas))
+    except Exception as e:
+        logger.error(f"🔴 Error updating sources of shared chunks: {e}")
+    manifest.save()
+    lexical_index.save()
+
+    if documents_pruned:
+        logger.info(
+            f"🟢 Pruned {chunks_removed} chunks of {len(documents_pruned)} deleted documents"
         )
+    return {
+        "status": "success",
+        "documents": sorted(documents_pruned),
+        "chunks_removed": chunks_removed,
+    }
 
-        context = ""
-        if (
-            results
-            and results.get("documents", [[]])
-            and len(results.get("documents", [[]])[0]) > 0
-        ):
-            for doc, metadata in zip(results["documents"][0], results["metadatas"][0]):
-                source = os.path.basename(metadata["source"])
-                context += f"\n--- From {source} ---\n{doc}\n"
-        return context
-    except Exception as e:
-        logger.error(f"🔴 Error querying vector database: {e}")
-        return "🔴 Error retrieving context from database."
+
+def query_vector_db(collection, query, n_results=config.SEARCH_RESULTS):
+    """Search the vector database for relevant context"""
+    from modules.retrieval import retrieve
+
+    return retrieve(collection, query, n_results=n_results).context
 
 
 def list_documents():
     """Return a list of all documents in the docs directory"""
-    valid_ext = (".txt", ".md", ".yaml", ".yml")
-    doc_files = []
-
-    for root, _, files in os.walk(config.DOCS_DIR):
-        for file in files:
-            if not file.startswith(".") and file.endswith(valid_ext):
-                rel_path = os.path.relpath(
-                    os.path.join(root, file), config.DOCS_DIR)
-                file_path = os.path.join(config.DOCS_DIR, rel_path)
-                try:
-                    mtime = os.path.getmtime(file_path)
-                    size = os.path.getsize(file_path)
-                    doc_files.append(
-                        {
-                            "name": file,
-                            "path": rel_path,
-                            "size": size,
-                            "mtime": mtime,
-                            "modified": datetime.fromtimestamp(mtime).strftime(
-                                "%Y-%m-%d %H:%M"
-                            ),
-                        }
-                    )
-                except Exception as e:
-                    logger.error(
-                        f"🔴 Error getting file info for {file_path}: {e}")
+    doc_files = [
+        {
+            "name": info["name"],
+            "path": info["path"],
+            "size": info["size"],
+            "mtime": info["mtime"],
+            "modified": datetime.fromtimestamp(info["mtime"]).strftime(
+                "%Y-%m-%d %H:%M"
+            ),
+        }
+        for info in get_catalog().documents()
+    ]
 
     # Sort files by name
     doc_files.sort(key=lambda x: x["name"].lower())
@@ -462,6 +495,7 @@ def save_document_content(file_path, content):
             }
 
         logger.info(f"🟢 Successfully saved content to: {file_path}")
+        get_catalog().invalidate()
 
         # If the file is indexed, mark it as needing reindexing
         # This will add it to the "modified" list in document_status
@@ -0,0 +1,263 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+import time
+from typing import List, Union
+import numpy as np
+from modules.utils import ID_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed embedding cache backed by SQLite.
+
+    Embeddings are keyed by (embedding model, SHA-256 of the text) and stored
+    as float32 blobs. The cache is bounded by entry count; when it grows past
+    the limit, the least recently used entries are evicted.
+    """
+
+    # Fraction of max_entries to keep after an eviction pass, so we don't
+    # evict on every single insert once the cache is full
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, path, max_entries=200000):
+        """
+        Initialize the embedding cache.
+
+        Args:
+            path (str): Path of the SQLite database file
+            max_entries (int): Maximum number of embeddings to keep
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+        self._entries = self._conn.execute(
+            "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+        logger.info(
+            f"🟢 Embedding cache opened at {path} with {self._entries} entries")
+
+    @staticmethod
+    def hash_text(text):
+        """Return the content hash used as the cache key for a text"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model, texts):
+        """
+        Look up cached embeddings for a list of texts.
+
+        Args:
+            model (str): Embedding model name
+            texts (list): Texts to look up
+
+        Returns:
+            dict: Mapping of text index to embedding (list of floats) for hits
+        """
+        if not texts:
+            return {}
+
+        hashes = [self.hash_text(text) for text in texts]
+        found = {}
+
+        with self._lock:
+            unique_hashes = list(set(hashes))
+            for i in range(0, len(unique_hashes), ID_BATCH_SIZE):
+                batch = unique_hashes[i: i + ID_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, vector in rows:
+                    found[text_hash] = np.frombuffer(
+                        vector, dtype=np.float32).tolist()
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, text_hash) for text_hash in found],
+                )
+                self._conn.commit()
+
+            results = {
+                index: found[text_hash]
+                for index, text_hash in enumerate(hashes)
+                if text_hash in found
+            }
+            self.hits += len(results)
+            self.misses += len(texts) - len(results)
+
+        return results
+
+    def put_many(self, model, texts, embeddings):
+        """
+        Store embeddings for a list of texts.
+
+        Args:
+            model (str): Embedding model name
+            texts (list): Texts that were embedded
+            embeddings (list): Embeddings in the same order as texts
+        """
+        if not texts:
+            return
+
+        now = time.time()
+        rows = [
+            (
+                model,
+                self.hash_text(text),
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+                now,
+            )
+            for text, embedding in zip(texts, embeddings)
+        ]
+
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._entries += self._conn.total_changes - before
+            self._evict_if_needed()
+            self._conn.commit()
+
+    def _evict_if_needed(self):
+        """Evict least recently used entries once over max_entries (lock held)"""
+        if not self.max_entries or self._entries <= self.max_entries:
+            return
+
+        to_evict = self._entries - int(self.max_entries * self.EVICTION_TARGET)
+        self._conn.execute(
+            """
+            DELETE FROM embeddings WHERE rowid IN (
+                SELECT rowid FROM embeddings ORDER BY last_used ASC LIMIT ?
+            )
+            """,
+            (to_evict,),
+        )
+        self._entries -= to_evict
+        self.evictions += to_evict
+        logger.info(f"🟡 Evicted {to_evict} entries from embedding cache")
+
+    def clear(self):
+        """Remove all cached embeddings"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._entries = 0
+
+    def get_stats(self):
+        """Get cache counters as a dictionary"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "evictions": self.evictions,
+        }
+
+
+class CachedEmbeddingFunction:
+    """
+    Embedding function wrapper that consults an EmbeddingCache before
+    calling the underlying embedding function for cache misses.
+    """
+
+    def __init__(self, embedding_function, cache, model_name):
+        """
+        Initialize the cached embedding function.
+
+        Args:
+            embedding_function: Embedding function to call for cache misses
+            cache (EmbeddingCache): Cache to read from and write to
+            model_name (str): Model name used to namespace cache keys
+        """
+        self.embedding_function = embedding_function
+        self.cache = cache
+        self.model_name = model_name
+
+    def __call__(self, input: Union[str, List[str]]) -> List[List[float]]:
+        """
+        Generate embeddings, serving cached ones where possible.
+
+        Args:
+            input: Text or list of texts to embed
+
+        Returns:
+            List of embeddings as lists of floats
+        """
+        texts = [input] if isinstance(input, str) else list(input)
+        if not texts:
+            return []
+
+        embeddings = [None] * len(texts)
+        try:
+            for index, embedding in self.cache.get_many(self.model_name, texts).items():
+                embeddings[index] = embedding
+        except Exception as e:
+            logger.error(f"🔴 Error reading embedding cache: {e}")
+
+        missing = [i for i, embedding in enumerate(embeddings)
+                   if embedding is None]
+        if missing:
+            # Embed each distinct missing text only once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = {
+                text: [float(x) for x in embedding]
+                for text, embedding in zip(
+                    unique_texts, self.embedding_function(unique_texts))
+            }
+            for index in missing:
+                embeddings[index] = computed[texts[index]]
+
+            cacheable_texts, cacheable_embeddings = [], []
+            for text, embedding in computed.items():
+                # Never cache the all-zero placeholder returned on API errors
+                if any(embedding):
+                    cacheable_texts.append(text)
+                    cacheable_embeddings.append(embedding)
+
+            try:
+                self.cache.put_many(
+                    self.model_name, cacheable_texts, cacheable_embeddings)
+            except Exception as e:
+                logger.error(f"🔴 Error writing embedding cache: {e}")
+
+        logger.debug(
+            f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses"
+        )
+        return embeddings
@@ -0,0 +1,239 @@
+import logging
+import time
+from modules.utils import ID_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkWriter:
+    """
+    Buffers chunk writes and deletes across files and applies them to the
+    collection in batches.
+
+    Each flush applies pending deletes first, then adds pending chunks with
+    one collection.add call, so the embedding function also sees the whole
+    batch at once. If a batch add fails, its chunks are retried one by one
+    so the failing chunk is reported precisely. A document is recorded in
+    the manifest once all of its chunks have been written. Written and
+    deleted chunks are mirrored into the lexical index, if one is given.
+    """
+
+    def __init__(self, collection, manifest, batch_size=256, on_complete=None,
+                 lexical_index=None):
+        """
+        Initialize the chunk writer.
+
+        Args:
+            collection: ChromaDB collection to write to
+            manifest (IndexManifest): Manifest to record completed documents in
+            batch_size (int): Number of chunks per collection.add call
+            on_complete (callable): Called with (rel_path, chunks written) once
+                a document has been recorded (optional)
+            lexical_index (LexicalIndex): Keyword index to keep in step with
+                the collection (optional)
+        """
+        self.collection = collection
+        self.manifest = manifest
+        self.lexical_index = lexical_index
+        self.batch_size = max(1, batch_size)
+        self.on_complete = on_complete
+        self.chunks_written = 0
+        self.chunks_deleted = 0
+        self.chunks_updated = 0
+        self.batches = 0
+        self.errors = []
+        self._pending_deletes = []
+        self._pending_updates = ([], [])
+        self._ids, self._documents, self._metadatas, self._owners = [], [], [], []
+        self._embeddings = []
+        self._files = {}
+
+    def delete(self, ids, rel_path=None):
+        """
+        Queue chunk ids for deletion.
+
+        Args:
+            ids (list): Chunk ids to delete
+            rel_path (str): Document the chunks belong to, dropped from the
+                manifest (optional)
+        """
+        if rel_path is not None:
+            self.manifest.remove(rel_path)
+        self._pending_deletes.extend(ids)
+        if len(self._pending_deletes) >= self.batch_size:
+            self._flush_deletes()
+
+    def update(self, ids, metadatas):
+        """Queue metadata updates for chunks that are already indexed"""
+        self._pending_updates[0].extend(ids)
+        self._pending_updates[1].extend(metadatas)
+
+    def rewrite(self, ids, documents, embeddings=None):
+        """
+        Replace the text of chunks that are already indexed, immediately.
+
+        Args:
+            ids (list): Chunk ids
+            documents (list): New chunk texts
+            embeddings (list): Embeddings of the new texts (optional, the
+                collection embeds them otherwise)
+        """
+        try:
+            for i in range(0, len(ids), ID_BATCH_SIZE):
+                self.collection.update(
+                    ids=ids[i: i + ID_BATCH_SIZE],
+                    documents=documents[i: i + ID_BATCH_SIZE],
+                    embeddings=embeddings[i: i + ID_BATCH_SIZE] if embeddings is not None else None,
+                )
+            self.chunks_updated += len(ids)
+        except Exception as e:
+            logger.error(f"🔴 Error rewriting {len(ids)} shared chunks: {e}")
+            return
+        if self.lexical_index is not None:
+            for chunk_id, document in zip(ids, documents):
+                self.lexical_index.add(chunk_id, document)
+
+    def begin_file(self, rel_path, source, mtime, size, content_hash, chunk_ids, pending):
+        """
+        Register a document whose chunks are about to be added.
+
+        Args:
+            rel_path (str): Document path relative to DOCS_DIR
+            source (str): Source path stored in chunk metadata
+            mtime (float): File modification time
+            size (int): File size
+            content_hash (str): SHA-256 of the file content
+            chunk_ids (list): Ids of all of the document's chunks, in order
+            pending (int): Number of those chunks that will be added; the
+                rest are already in the collection
+        """
+        self._files[rel_path] = {
+            "source": source,
+            "mtime": mtime,
+            "size": size,
+            "hash": content_hash,
+            "remaining": pending,
+            "chunk_ids": chunk_ids,
+            "failed": set(),
+        }
+        if pending == 0:
+            self._complete(rel_path)
+
+    def add(self, rel_path, chunk_id, document, metadata, embedding=None):
+        """Queue one chunk of a registered document, optionally pre-embedded"""
+        self._ids.append(chunk_id)
+        self._embeddings.append(embedding)
+        self._documents.append(document)
+        self._metadatas.append(metadata)
+        self._owners.append(rel_path)
+        if len(self._ids) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Apply all pending deletes, metadata updates and adds"""
+        self._flush_deletes()
+        self._flush_updates()
+        if not self._ids:
+            return
+
+        ids, documents, metadatas, owners = (
+            self._ids, self._documents, self._metadatas, self._owners)
+        embeddings = self._embeddings
+        self._ids, self._documents, self._metadatas, self._owners = [], [], [], []
+        self._embeddings = []
+        # Let the collection embed the batch unless every chunk came embedded
+        if any(embedding is None for embedding in embeddings):
+            embeddings = None
+
+        start_time = time.time()
+        try:
+            self.collection.add(
+                ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+            results = [None] * len(ids)
+        except Exception as e:
+            logger.warning(
+                f"🟡 Batch add of {len(ids)} chunks failed, retrying one by one: {e}")
+            results = []
+            for i, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+                try:
+                    self.collection.add(
+                        ids=[chunk_id],
+                        documents=[document],
+                        metadatas=[metadata],
+                        embeddings=[embeddings[i]] if embeddings else None,
+                    )
+                    results.append(None)
+                except Exception as chunk_error:
+                    results.append(chunk_error)
+
+        self.batches += 1
+        for chunk_id, document, metadata, owner, error in zip(
+                ids, documents, metadatas, owners, results):
+            if error is None:
+                self.chunks_written += 1
+                if self.lexical_index is not None:
+                    self.lexical_index.add(chunk_id, document)
+            else:
+                self._files[owner]["failed"].add(chunk_id)
+                self.errors.append(
+                    {"file": owner, "chunk_id": chunk_id, "error": str(error)})
+                logger.error(
+                    f"🔴 Error adding chunk {metadata.get('chunk', chunk_id)} from {owner}: {error}"
+                )
+            self._files[owner]["remaining"] -= 1
+            if self._files[owner]["remaining"] == 0:
+                self._complete(owner)
+
+        logger.info(
+            f"🟢 Wrote batch of {len(ids)} chunks in {time.time() - start_time:.2f}s")
+
+    def _flush_deletes(self):
+        if not self._pending_deletes:
+            return
+        ids = self._pending_deletes
+        self._pending_deletes = []
+        try:
+            for i in range(0, len(ids), ID_BATCH_SIZE):
+                self.collection.delete(ids=ids[i: i + ID_BATCH_SIZE])
+            self.chunks_deleted += len(ids)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(ids)
+        except Exception as e:
+            logger.error(f"🔴 Error deleting {len(ids)} old chunks: {e}")
+
+    def _flush_updates(self):
+        ids, metadatas = self._pending_updates
+        if not ids:
+            return
+        self._pending_updates = ([], [])
+        try:
+            for i in range(0, len(ids), ID_BATCH_SIZE):
+                self.collection.update(
+                    ids=ids[i: i + ID_BATCH_SIZE], metadatas=metadatas[i: i + ID_BATCH_SIZE])
+            self.chunks_updated += len(ids)
+        except Exception as e:
+            logger.error(f"🔴 Error updating metadata of {len(ids)} chunks: {e}")
+
+    def _complete(self, rel_path):
+        """Record a fully written document in the manifest"""
+        info = self._files.pop(rel_path)
+        chunk_ids = [
+            chunk_id for chunk_id in info["chunk_ids"] if chunk_id not in info["failed"]
+        ]
+        self.manifest.record(
+            rel_path,
+            info["source"],
+            chunk_ids,
+            info["mtime"],
+            info["size"],
+            info["hash"],
+        )
+        if self.on_complete is not None:
+            self.on_complete(rel_path, len(chunk_ids))
+
+    def close(self):
+        """Flush everything and save the manifest and lexical index"""
+        self.flush()
+        self.manifest.save()
+        if self.lexical_index is not None:
+            self.lexical_index.save()
@@ -0,0 +1,642 @@
+import os
+import hashlib
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait,
+)
+import yaml
+import config
+from modules.utils import (
+    iter_chunk_parts,
+    iter_markdown_parts,
+    iter_yaml_records,
+    sources_metadata,
+)
+from modules.index_writer import ChunkWriter
+
+logger = logging.getLogger(__name__)
+
+VALID_EXTENSIONS = (".txt", ".md", ".yaml", ".yml")
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+def content_chunk_ids(texts):
+    """
+    Derive chunk ids from chunk content.
+
+    An id is a hash of the chunk body alone, so an unchanged chunk keeps its
+    id wherever it moves in the file, and identical text in different
+    documents gets the same id and is stored once.
+
+    Args:
+        texts (list): Chunk bodies in document order
+
+    Returns:
+        list: Chunk ids in the same order
+    """
+    return [hashlib.sha256(text.encode("utf-8")).hexdigest()[:32] for text in texts]
+
+
+def _unique_records(records):
+    """Drop records repeating an earlier record's text, keeping the first"""
+    seen = set()
+    unique = []
+    for record in records:
+        if record[0] not in seen:
+            seen.add(record[0])
+            unique.append(record)
+    return unique
+
+
+def prepare_document(file_path, docs_dir):
+    """
+    Read, parse and chunk one document.
+
+    Runs on a worker thread, so it only returns plain data and reports
+    failures in the result instead of logging them.
+
+    Args:
+        file_path (str): Normalized path of the document
+        docs_dir (str): Documentation directory
+
+    Returns:
+        dict: rel_path, source, mtime, size, hash and records, a list of
+              (chunk id, text, metadata, body) tuples, where the body is the
+              text without the context that depends on the document and
+              the id is derived from the body; or an "error"/"skipped" key
+    """
+    start_time = time.time()
+    doc = {"rel_path": os.path.relpath(file_path, docs_dir), "source": file_path}
+    if not file_path.endswith(VALID_EXTENSIONS):
+        doc["skipped"] = True
+        return doc
+
+    try:
+        stat = os.stat(file_path)
+        mtime = str(stat.st_mtime)
+        with open(file_path, "r", encoding="utf-8") as f:
+            raw = f.read()
+        doc.update(
+            mtime=stat.st_mtime,
+            size=stat.st_size,
+            hash=hashlib.sha256(raw.encode("utf-8")).hexdigest(),
+        )
+
+        if file_path.endswith(".md") and config.CHUNK_MARKDOWN_SECTIONS:
+            # Chunks follow the document's sections and record where they sit
+            parts = list(iter_markdown_parts(raw))
+            bodies = [body for _, _, body in parts]
+            doc["records"] = [
+                (chunk_id, context + body,
+                 {"source": file_path, "chunk": i, "mtime": mtime,
+                  "section": " > ".join(path)},
+                 body)
+                for i, (chunk_id, (path, context, body)) in enumerate(
+                    zip(content_chunk_ids(bodies), parts))
+            ]
+        elif file_path.endswith((".txt", ".md")):
+            parts = list(iter_chunk_parts(raw))
+            bodies = [body for _, body in parts]
+            doc["records"] = [
+                (chunk_id, context + body,
+                 {"source": file_path, "chunk": i, "mtime": mtime},
+                 body)
+                for i, (chunk_id, (context, body)) in enumerate(
+                    zip(content_chunk_ids(bodies), parts))
+            ]
+        else:
+            # One record per entity, e.g. per site under regions.*.sites
+            records = list(iter_yaml_records(yaml.safe_load(raw)))
+            texts = [text for _, text, _ in records]
+            doc["records"] = [
+                (chunk_id, text,
+                 {"source": file_path, "type": "config", "chunk": i,
+                  "mtime": mtime, **metadata},
+                 text)
+                for i, (chunk_id, text, (_, _, metadata)) in enumerate(
+                    zip(content_chunk_ids(texts), texts, records))
+            ]
+        doc["records"] = _unique_records(doc["records"])
+    except Exception as e:
+        doc["error"] = str(e)
+
+    doc["seconds"] = time.time() - start_time
+    return doc
+
+
+class StageStats:
+    """Item counts and busy time for one pipeline stage"""
+
+    def __init__(self, name, workers=1):
+        self.name = name
+        self.workers = max(1, workers)
+        self.files = 0
+        self.chunks = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, files=0, chunks=0, seconds=0.0):
+        with self._lock:
+            self.files += files
+            self.chunks += chunks
+            self.busy += seconds
+
+    def as_dict(self, elapsed):
+        """
+        Summarize the stage.
+
+        Utilization is busy time over the time the stage's workers were
+        available; the stage closest to 1.0 is the bottleneck.
+        """
+        return {
+            "files": self.files,
+            "chunks": self.chunks,
+            "busy_seconds": round(self.busy, 3),
+            "chunks_per_second": round(self.chunks / self.busy, 1) if self.busy else None,
+            "utilization": round(self.busy / (elapsed * self.workers), 3) if elapsed else 0.0,
+        }
+
+
+class IndexingPipeline:
+    """
+    Staged indexing pipeline.
+
+    Documents are read, parsed and chunked by a thread pool, embedded in
+    batches by a thread pool, and written to the collection by a single
+    writer thread. The stages are connected by bounded queues, so a slow
+    stage blocks the ones feeding it and memory stays flat however many
+    documents are queued.
+
+    A chunk whose text is already stored for another document is not
+    embedded or written again; the existing chunk gains the document as a
+    source instead.
+    """
+
+    def __init__(
+        self,
+        collection,
+        manifest,
+        embedding_function=None,
+        workers=None,
+        embed_workers=None,
+        batch_size=None,
+        queue_size=None,
+        job=None,
+        replace=False,
+        lexical_index=None,
+    ):
+        """
+        Initialize the pipeline.
+
+        Args:
+            collection: ChromaDB collection to write to
+            manifest (IndexManifest): Manifest to record indexed documents in
+            embedding_function: Function used to embed chunks before they are
+                written (optional, the collection embeds them otherwise)
+            workers (int): Threads used to read and chunk documents
+            embed_workers (int): Concurrent embedding batches
+            batch_size (int): Chunks per embedding batch and collection write
+            queue_size (int): Maximum items waiting between two stages
+            job (IndexJob): Background job to report progress to and check
+                for cancellation (optional)
+            replace (bool): Rewrite every chunk of each document instead of
+                only the chunks whose content changed
+            lexical_index (LexicalIndex): Keyword index updated alongside the
+                collection (optional)
+        """
+        self.collection = collection
+        self.manifest = manifest
+        self.embedding_function = embedding_function
+        self.workers = workers or config.INDEX_WORKERS
+        self.embed_workers = embed_workers or config.INDEX_EMBED_WORKERS
+        self.batch_size = batch_size or config.INDEX_BATCH_SIZE
+        self.queue_size = queue_size or config.INDEX_QUEUE_SIZE
+        self.job = job
+        self.replace = replace
+        self.chunks_reused = 0
+        self.chunks_shared = 0
+        self.docs_dir = None
+        # Documents referencing each chunk id, as of the documents diffed so far
+        self._refs = {}
+        self._paths = {}
+        self._shared = set()
+        # Chunks stored with their body only, because they were already shared
+        self._stored_shared = set()
+        self._bodies = {}
+        self._written = set()
+        self.writer = ChunkWriter(
+            collection, manifest, self.batch_size,
+            on_complete=job.file_done if job is not None else None,
+            lexical_index=lexical_index,
+        )
+
+        self.outcomes = {}
+        self.errors = []
+        self.stages = {
+            "prepare": StageStats("prepare", self.workers),
+            "embed": StageStats("embed", self.embed_workers),
+            "write": StageStats("write"),
+        }
+        self._prepared = queue.Queue(maxsize=self.queue_size)
+        self._to_write = queue.Queue(maxsize=self.queue_size)
+
+    def run(self, files, docs_dir):
+        """
+        Index documents through the pipeline.
+
+        Args:
+            files (list): (file path, ids of existing chunks to delete or None)
+                tuples.
+                Documents whose chunks are deleted are dropped from the
+                manifest when the delete is applied
+            docs_dir (str): Documentation directory
+
+        Returns:
+            dict: Per-stage statistics and totals for the run
+        """
+        start_time = time.time()
+        self.docs_dir = docs_dir
+        threads = [
+            threading.Thread(target=self._prepare_stage, args=(files, docs_dir),
+                             name="index-prepare", daemon=True),
+            threading.Thread(target=self._embed_stage,
+                             name="index-embed", daemon=True),
+            threading.Thread(target=self._write_stage,
+                             name="index-write", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.time() - start_time
+        stats = {
+            "elapsed_seconds": round(elapsed, 3),
+            "stages": {name: stage.as_dict(elapsed) for name, stage in self.stages.items()},
+            "chunks_written": self.writer.chunks_written,
+            "chunks_reused": self.chunks_reused,
+            "chunks_shared": self.chunks_shared,
+            "chunks_deleted": self.writer.chunks_deleted,
+            "chunk_errors": self.writer.errors,
+            "error": "; ".join(self.errors) or None,
+        }
+        bottleneck = max(
+            stats["stages"], key=lambda name: stats["stages"][name]["utilization"])
+        stats["bottleneck"] = bottleneck
+        logger.info(
+            f"🟢 Indexing pipeline finished in {elapsed:.2f}s: "
+            + ", ".join(
+                f"{name} {s['chunks_per_second'] or 0} chunks/s ({s['utilization']:.0%} busy)"
+                for name, s in stats["stages"].items()
+            )
+            + f"; bottleneck: {bottleneck}"
+        )
+        return stats
+
+    def _prepare_stage(self, files, docs_dir):
+        """Read and chunk documents, keeping at most queue_size in flight"""
+        try:
+            remaining = files
+            if self.workers > 1 and len(files) > 1:
+                remaining = self._prepare_in_pool(files, docs_dir)
+            for file_path, old_ids in remaining:
+                if self._cancelled():
+                    break
+                self._emit_prepared(prepare_document(file_path, docs_dir), old_ids)
+        except Exception as e:
+            self._fail("prepare", e)
+        finally:
+            self._prepared.put(_DONE)
+
+    def _prepare_in_pool(self, files, docs_dir):
+        """
+        Prepare documents on worker threads.
+
+        Threads rather than processes: forking the multithreaded app can
+        deadlock on locks held by other threads, and spawned processes would
+        re-import the app module and reopen the database.
+
+        Returns:
+            list: (file path, old ids) of documents the pool couldn't take,
+                  to be prepared in-process instead
+        """
+        pending = {}
+        position = 0
+        stalled = False
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="index-prepare"
+        ) as pool:
+            while True:
+                while not stalled and position < len(files) and len(pending) < self.queue_size:
+                    # Once cancelled, only documents already in flight finish
+                    if self._cancelled():
+                        break
+                    file_path, old_ids = files[position]
+                    try:
+                        future = pool.submit(prepare_document, file_path, docs_dir)
+                    except RuntimeError as e:
+                        logger.warning(
+                            f"🟡 Can't start indexing workers, preparing documents in-process: {e}")
+                        stalled = True
+                        break
+                    pending[future] = (file_path, old_ids)
+                    position += 1
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path, old_ids = pending.pop(future)
+                    try:
+                        doc = future.result()
+                    except Exception as e:
+                        doc = {
+                            "rel_path": os.path.relpath(file_path, docs_dir),
+                            "source": file_path,
+                            "error": str(e),
+                        }
+                    self._emit_prepared(doc, old_ids)
+        return files[position:]
+
+    def _fail(self, stage, error):
+        """Record a stage that stopped early, so the run is reported as failed"""
+        logger.error(f"🔴 Error in indexing {stage} stage: {error}")
+        self.errors.append(f"{stage}: {error}")
+
+    def _cancelled(self):
+        return self.job is not None and self.job.cancelled
+
+    def _emit_prepared(self, doc, old_ids):
+        doc["old_ids"] = old_ids
+        self.stages["prepare"].add(
+            files=1, chunks=len(doc.get("records", ())), seconds=doc.get("seconds", 0.0)
+        )
+        self._prepared.put(doc)
+
+    def _embed_stage(self):
+        """Group chunks across documents into batches and embed them concurrently"""
+        slots = threading.Semaphore(self.embed_workers * 2)
+        batch = []
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self.embed_workers, thread_name_prefix="index-embed"
+            ) as pool:
+
+                def submit(records):
+                    slots.acquire()
+                    future = pool.submit(self._embed_batch, records)
+                    future.add_done_callback(lambda _: slots.release())
+
+                while True:
+                    doc = self._prepared.get()
+                    if doc is _DONE:
+                        break
+
+                    if doc.get("skipped") or "error" in doc:
+                        # Chunks of a document that can no longer be read are
+                        # stale, so they're still removed
+                        if doc["old_ids"] is not None:
+                            self._to_write.put(
+                                ("delete", doc["rel_path"],
+                                 self._release(doc["rel_path"], doc["old_ids"])))
+                        if "error" in doc:
+                            logger.error(
+                                f"🔴 Error processing file {doc['source']}: {doc['error']}")
+                        self.outcomes[doc["rel_path"]] = (
+                            "error" if "error" in doc else "skipped")
+                        if self.job is not None:
+                            self.job.file_done(doc["rel_path"], 0)
+                        continue
+
+                    to_write, moved = self._diff_chunks(doc)
+                    self.outcomes[doc["rel_path"]] = "indexed"
+                    self._to_write.put(("begin", doc, len(to_write), moved))
+                    for record in to_write:
+                        batch.append((doc["rel_path"], record))
+                        if len(batch) >= self.batch_size:
+                            submit(batch)
+                            batch = []
+
+                if batch:
+                    submit(batch)
+            # Every add is queued by now, so chunks that became shared are
+            # rewritten, and the sources of shared chunks updated, after
+            # the chunks exist
+            self._rewrite_shared()
+            shared = self._shared_sources()
+            if shared:
+                self._to_write.put(("sources", shared))
+        except Exception as e:
+            self._fail("embed", e)
+        finally:
+            self._to_write.put(_DONE)
+
+    def _referrers(self, chunk_id):
+        """Documents referencing a chunk id, seeded from the manifest"""
+        refs = self._refs.get(chunk_id)
+        if refs is None:
+            refs = self._refs[chunk_id] = self.manifest.referrers(chunk_id)
+            if len(refs) > 1:
+                self._stored_shared.add(chunk_id)
+        return refs
+
+    def _release(self, rel_path, chunk_ids):
+        """
+        Drop a document's references to chunks.
+
+        Returns:
+            list: Ids of the chunks no other document references, which can
+                  be deleted
+        """
+        unreferenced = []
+        for chunk_id in chunk_ids:
+            refs = self._referrers(chunk_id)
+            refs.discard(rel_path)
+            if refs:
+                self._shared.add(chunk_id)
+            else:
+                unreferenced.append(chunk_id)
+        return unreferenced
+
+    def _source_path(self, rel_path):
+        if rel_path not in self._paths:
+            entry = self.manifest.get(rel_path)
+            self._paths[rel_path] = (
+                entry["source"] if entry
+                else os.path.normpath(os.path.join(self.docs_dir, rel_path))
+            )
+        return self._paths[rel_path]
+
+    def _shared_sources(self):
+        """(chunk id, metadata) updates listing the sources of shared chunks"""
+        updates = []
+        for chunk_id in sorted(self._shared):
+            refs = self._refs.get(chunk_id)
+            if refs:
+                sources = sorted(self._source_path(rel_path) for rel_path in refs)
+                updates.append((chunk_id, sources_metadata(sources)))
+        return updates
+
+    def _rewrite_shared(self):
+        """
+        Queue rewrites of chunks that became shared in this run.
+
+        A chunk is first stored with the text of the document that wrote it,
+        including context such as parent headings. Once other documents
+        share it, it is stored with its body alone, which reads the same
+        from every document.
+        """
+        rewrites = [
+            (chunk_id, body)
+            for chunk_id, body in sorted(self._bodies.items())
+            if len(self._refs.get(chunk_id, ())) > 1
+            and (chunk_id in self._written or chunk_id not in self._stored_shared)
+        ]
+        for i in range(0, len(rewrites), self.batch_size):
+            ids, bodies = zip(*rewrites[i: i + self.batch_size])
+            embeddings = None
+            if self.embedding_function is not None:
+                try:
+                    embeddings = self.embedding_function(list(bodies))
+                except Exception as e:
+                    logger.warning(
+                        f"🟡 Error embedding {len(bodies)} shared chunks: {e}")
+            self._to_write.put(("rewrite", list(ids), list(bodies), embeddings))
+
+    def _diff_chunks(self, doc):
+        """
+        Work out which chunks of a document have to be written.
+
+        Chunk ids are derived from chunk bodies, so a chunk whose id is
+        already indexed for the document is unchanged and is neither embedded
+        nor written again; only its position is refreshed if it moved. A
+        chunk already stored for another document is shared rather than
+        written. Old chunks that no other document references are queued for
+        deletion, always ahead of any new chunk.
+
+        With replace, every chunk of the document is rewritten, but a chunk
+        shared by several documents in the run is only written once.
+
+        Returns:
+            tuple: (records to embed and write, (id, metadata) pairs of
+                    unchanged chunks whose position changed)
+        """
+        rel_path = doc["rel_path"]
+        self._paths[rel_path] = doc["source"]
+        old_ids = doc["old_ids"] or []
+        records = doc["records"]
+        new_ids = {record[0] for record in records}
+        if self.replace:
+            kept = {}
+            unreferenced = set(self._release(rel_path, old_ids))
+            # Shared chunks the document still has are deleted and rewritten
+            # too, unless this run already rewrote them
+            deleted = [
+                chunk_id for chunk_id in old_ids
+                if chunk_id not in self._written
+                and (chunk_id in unreferenced or chunk_id in new_ids)
+            ]
+        else:
+            kept = {chunk_id: i for i, chunk_id in enumerate(old_ids)}
+            deleted = self._release(
+                rel_path, [chunk_id for chunk_id in old_ids if chunk_id not in new_ids])
+        if doc["old_ids"] is not None:
+            if deleted:
+                logger.info(f"🟡 Removing {len(deleted)} old chunks of {rel_path}")
+            self._to_write.put(("delete", rel_path, deleted))
+
+        to_write, moved = [], []
+        for i, (chunk_id, text, metadata, body) in enumerate(records):
+            refs = self._referrers(chunk_id)
+            others = refs - {rel_path}
+            if others:
+                # Kept in case the chunk has to be rewritten as shared
+                self._bodies[chunk_id] = body
+            if chunk_id in kept:
+                # Only a chunk the document doesn't share has a position of its own
+                if kept[chunk_id] != i and "chunk" in metadata and not others:
+                    moved.append((chunk_id, {"chunk": metadata["chunk"]}))
+            elif self.replace and chunk_id not in self._written or not others:
+                to_write.append((chunk_id, text, metadata))
+                self._written.add(chunk_id)
+            else:
+                self.chunks_shared += 1
+            if others:
+                self._shared.add(chunk_id)
+            refs.add(rel_path)
+        self.chunks_reused += len(records) - len(to_write)
+        return to_write, moved
+
+    def _embed_batch(self, records):
+        """Embed one batch and hand it to the writer"""
+        embeddings = None
+        if self.embedding_function is not None:
+            start_time = time.time()
+            try:
+                embeddings = self.embedding_function(
+                    [text for _, (_, text, _) in records])
+            except Exception as e:
+                # The writer lets the collection embed them instead, which
+                # also reports failures per chunk
+                logger.warning(f"🟡 Error embedding batch of {len(records)} chunks: {e}")
+            self.stages["embed"].add(
+                chunks=len(records), seconds=time.time() - start_time)
+        self._to_write.put(("chunks", records, embeddings))
+
+    def _write_stage(self):
+        """Apply deletes and writes to the collection from a single thread"""
+        while True:
+            item = self._to_write.get()
+            if item is _DONE:
+                break
+            start_time = time.time()
+            try:
+                if item[0] == "delete":
+                    self.writer.delete(item[2], rel_path=item[1])
+                    chunks = 0
+                elif item[0] == "rewrite":
+                    # Applied once every pending chunk has been added
+                    self.writer.flush()
+                    self.writer.rewrite(*item[1:])
+                    chunks = len(item[1])
+                elif item[0] == "sources":
+                    # Applied once every pending chunk has been added
+                    self.writer.flush()
+                    self.writer.update(*zip(*item[1]))
+                    chunks = 0
+                elif item[0] == "begin":
+                    _, doc, pending, moved = item
+                    if moved:
+                        self.writer.update(*zip(*moved))
+                    self.writer.begin_file(
+                        doc["rel_path"], doc["source"], doc["mtime"], doc["size"],
+                        doc["hash"], [record[0] for record in doc["records"]],
+                        pending,
+                    )
+                    chunks = 0
+                else:
+                    _, records, embeddings = item
+                    for i, (rel_path, (chunk_id, text, metadata)) in enumerate(records):
+                        self.writer.add(
+                            rel_path, chunk_id, text, metadata,
+                            embeddings[i] if embeddings is not None else None
+                        )
+                    chunks = len(records)
+            except Exception as e:
+                logger.error(f"🔴 Error in indexing write stage: {e}")
+                chunks = 0
+            self.stages["write"].add(
+                chunks=chunks, seconds=time.time() - start_time)
+
+        start_time = time.time()
+        try:
+            self.writer.close()
+        except Exception as e:
+            self._fail("write", e)
+        self.stages["write"].add(seconds=time.time() - start_time)
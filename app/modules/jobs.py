@@ -0,0 +1,333 @@
+import os
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import config
+from modules.manifest import get_manifest
+
+logger = logging.getLogger(__name__)
+
+
+class IndexJob:
+    """
+    One background indexing run.
+
+    Tracks progress as documents finish, and periodically checkpoints the
+    documents still to do so an interrupted run can be resumed.
+    """
+
+    def __init__(self, specific_files=None, force_reindex=False, checkpoint_path=None,
+                 kind="index"):
+        """
+        Initialize the job.
+
+        Args:
+            specific_files (list): Documents to index, relative to DOCS_DIR (optional)
+            force_reindex (bool): Whether to reindex every document
+            checkpoint_path (str): Where to write checkpoints (optional)
+            kind (str): "index", or "prune" to only remove chunks of
+                documents that no longer exist
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.specific_files = specific_files
+        self.force_reindex = force_reindex
+        self.checkpoint_path = checkpoint_path
+        self.status = "queued"
+        self.files_total = 0
+        self.files_done = 0
+        self.chunks_done = 0
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._pending = set()
+        self._last_checkpoint = 0.0
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Ask the job to stop; documents already in flight still finish"""
+        self._cancel.set()
+
+    def start(self, rel_paths):
+        """Record the documents this run will process"""
+        with self._lock:
+            self.status = "running"
+            self.started_at = time.time()
+            self.files_total = len(rel_paths)
+            self._pending = set(rel_paths)
+        self.checkpoint(force=True)
+
+    def file_done(self, rel_path, chunks):
+        """Record a finished document"""
+        with self._lock:
+            self.files_done += 1
+            self.chunks_done += chunks
+            self._pending.discard(rel_path)
+        self.checkpoint()
+
+    def checkpoint(self, force=False):
+        """
+        Write the documents still to do, at most every INDEX_CHECKPOINT_INTERVAL
+        seconds unless forced. The manifest is saved first so the checkpoint
+        never claims more than the manifest on disk records.
+        """
+        if not self.checkpoint_path:
+            return
+        now = time.time()
+        if not force and now - self._last_checkpoint < config.INDEX_CHECKPOINT_INTERVAL:
+            return
+        self._last_checkpoint = now
+
+        get_manifest().save()
+        with self._lock:
+            data = {
+                "job_id": self.id,
+                "force_reindex": self.force_reindex,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "pending": sorted(self._pending),
+                "updated_at": now,
+            }
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.checkpoint_path)
+        except Exception as e:
+            logger.error(f"🔴 Error writing indexing checkpoint: {e}")
+
+    def clear_checkpoint(self):
+        """Remove the checkpoint once the run has completed"""
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            try:
+                os.remove(self.checkpoint_path)
+            except Exception as e:
+                logger.error(f"🔴 Error removing indexing checkpoint: {e}")
+
+    def finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+        self._finished.set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished, returning True if it has"""
+        return self._finished.wait(timeout)
+
+    def to_dict(self):
+        """Get the job's progress as a dictionary"""
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            files_rate = self.files_done / elapsed if elapsed > 0 else 0.0
+            chunks_rate = self.chunks_done / elapsed if elapsed > 0 else 0.0
+            remaining = self.files_total - self.files_done
+            eta = None
+            if self.status == "running" and files_rate > 0:
+                eta = round(remaining / files_rate, 1)
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "force_reindex": self.force_reindex,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "chunks_done": self.chunks_done,
+                "percent": round(100.0 * self.files_done / self.files_total, 1)
+                if self.files_total else (100.0 if self.finished_at else 0.0),
+                "files_per_second": round(files_rate, 2),
+                "chunks_per_second": round(chunks_rate, 1),
+                "elapsed_seconds": round(elapsed, 1),
+                "eta_seconds": eta,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class IndexJobManager:
+    """
+    Runs indexing jobs one at a time on a background thread, so HTTP
+    requests only submit work and poll its progress. Prunes run on the same
+    thread, so nothing else changes the collection, manifest or lexical
+    index while a job is running.
+    """
+
+    def __init__(self, collection, checkpoint_path=None, max_history=20):
+        """
+        Initialize the job manager.
+
+        Args:
+            collection: ChromaDB collection to index into
+            checkpoint_path (str): Checkpoint file for resuming interrupted runs
+            max_history (int): Number of finished jobs kept for status queries
+        """
+        self.collection = collection
+        self.checkpoint_path = checkpoint_path or config.INDEX_CHECKPOINT_PATH
+        self.max_history = max_history
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, specific_files=None, force_reindex=False):
+        """
+        Queue an indexing run.
+
+        Args:
+            specific_files (list): Documents to index, relative to DOCS_DIR (optional)
+            force_reindex (bool): Whether to reindex every document
+
+        Returns:
+            IndexJob: The queued job
+        """
+        return self._enqueue(IndexJob(specific_files, force_reindex, self.checkpoint_path))
+
+    def submit_prune(self):
+        """
+        Queue a prune of the chunks of documents that no longer exist.
+
+        Returns:
+            IndexJob: The queued job
+        """
+        return self._enqueue(IndexJob(kind="prune"))
+
+    def _enqueue(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="index-jobs", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        logger.info(f"🟡 Queued {job.kind} job {job.id}")
+        return job
+
+    def _trim(self):
+        """Forget the oldest finished jobs beyond max_history"""
+        finished = [jid for jid, job in self._jobs.items()
+                    if job.finished_at is not None]
+        for jid in finished[: max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[jid]
+
+    def _run(self):
+        """Worker loop"""
+        from modules.document_manager import index_documents
+
+        while True:
+            job = self._queue.get()
+            try:
+                if job.cancelled:
+                    job.finish("cancelled")
+                    continue
+                if job.kind == "prune":
+                    job.start([])
+                    result = self._prune()
+                else:
+                    result = index_documents(
+                        self.collection,
+                        specific_files=job.specific_files,
+                        force_reindex=job.force_reindex,
+                        job=job,
+                    )
+                if result.get("status") == "error":
+                    job.finish("failed", result, result.get("error"))
+                elif job.cancelled:
+                    job.checkpoint(force=True)
+                    job.finish("cancelled", result)
+                else:
+                    job.clear_checkpoint()
+                    job.finish("completed", result)
+                logger.info(f"🟢 {job.kind.capitalize()} job {job.id} {job.status}")
+            except Exception as e:
+                logger.error(f"🔴 {job.kind.capitalize()} job {job.id} failed: {e}")
+                job.finish("failed", error=str(e))
+            finally:
+                self._queue.task_done()
+
+    def _prune(self):
+        """Prune the index, reporting the collection size before and after"""
+        from modules import chromadb_handler
+        from modules.document_manager import prune_index
+
+        before = self.collection.count() if self.collection is not None else 0
+        result = prune_index(self.collection)
+        if result.get("status") == "success":
+            chromadb_handler.db_status.update_document_count(self.collection)
+            result["collection_count"] = {
+                "before": before, "after": self.collection.count()}
+        return result
+
+    def get(self, job_id):
+        """Get a job by id, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        """Get all known jobs, newest first"""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job, returning it or None"""
+        job = self.get(job_id)
+        if job is not None and job.finished_at is None:
+            job.cancel()
+            logger.info(f"🟡 Cancelling indexing job {job_id}")
+        return job
+
+    def interrupted(self):
+        """
+        Get the checkpoint left by a run that didn't complete, or None. A
+        checkpoint that belongs to a job still queued or running is not
+        reported.
+        """
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"🔴 Error reading indexing checkpoint: {e}")
+            return None
+        job = self.get(data.get("job_id"))
+        if job is not None and job.finished_at is None:
+            return None
+        return data
+
+    def resume(self):
+        """
+        Resume an interrupted run from its checkpoint.
+
+        Returns:
+            IndexJob: The new job indexing the remaining documents, or None
+                if there is nothing to resume
+        """
+        checkpoint = self.interrupted()
+        if not checkpoint or not checkpoint.get("pending"):
+            return None
+        logger.info(
+            f"🟡 Resuming indexing job {checkpoint['job_id']} with "
+            f"{len(checkpoint['pending'])} documents left"
+        )
+        # The remaining documents are passed as specific files. Unchanged
+        # chunks in them are skipped unless the interrupted run was forced,
+        # in which case they are still rewritten
+        return self.submit(
+            specific_files=checkpoint["pending"],
+            force_reindex=checkpoint.get("force_reindex", False),
+        )
@@ -0,0 +1,414 @@
+import os
+import re
+import json
+import math
+import heapq
+import bisect
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+import config
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_VERSION = 1
+
+# Chunks read per collection.get call when rebuilding
+REBUILD_BATCH = 5000
+
+# Postings scored per query term. A term found in more chunks than this
+# only scores its highest-impact chunks, so common terms cost the same as
+# rare ones; their low IDF means they rarely decide the top results anyway.
+POSTINGS_LIMIT = 1000
+
+# Words joined by dots, slashes, colons, dashes or underscores stay one
+# token, so 10.20.0.1/24, Gi1/0/1, core-sw-01 and aa:bb:cc:dd:ee:ff survive
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./:_-][a-z0-9]+)*")
+IPV4_PATTERN = re.compile(r"^\d{1,3}(?:\.\d{1,3}){3}$")
+ALPHA_NUMERIC = re.compile(r"^([a-z]+)(\d+)$")
+
+# Interface names are matched in their short form, whichever form is written
+INTERFACE_PREFIXES = (
+    ("tengigabitethernet", "te"),
+    ("gigabitethernet", "gi"),
+    ("fastethernet", "fa"),
+    ("port-channel", "po"),
+    ("ethernet", "eth"),
+)
+INTERFACE_SHORT_NAMES = dict(INTERFACE_PREFIXES)
+INTERFACE_NAME = re.compile(
+    r"^(" + "|".join(long for long, _ in INTERFACE_PREFIXES) + r")(\d.*)$")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by can do does for from has have how i if in "
+    "is it its me my no not of on or our so that the their then there these "
+    "this to was we what when where which who why will with you your".split()
+)
+
+
+def tokenize(text):
+    """
+    Split text into search terms.
+
+    Terms are lowercased. Compound tokens are kept whole and, where useful,
+    also indexed in parts: core-sw-01 adds core, sw and 01; vlan100 adds
+    vlan and 100; 10.1.2.0/24 adds 10.1.2.0. Long interface names are
+    shortened, so GigabitEthernet1/0/1 and Gi1/0/1 are the same term.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        list: Terms in text order
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        match = INTERFACE_NAME.match(token)
+        if match:
+            token = INTERFACE_SHORT_NAMES[match.group(1)] + match.group(2)
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+
+        if "/" in token:
+            address = token.rsplit("/", 1)[0]
+            if IPV4_PATTERN.match(address):
+                terms.append(address)
+        if "-" in token or "_" in token:
+            terms.extend(part for part in re.split(r"[-_]", token) if part)
+        match = ALPHA_NUMERIC.match(token)
+        if match:
+            terms.extend(match.groups())
+    return terms
+
+
+class LexicalIndex:
+    """
+    In-process BM25 index over the chunks in the collection.
+
+    An inverted index of term -> {chunk id: term frequency}, kept next to
+    the ChromaDB data and updated by the index writer as chunks are added
+    and deleted. Only term frequencies are stored; chunk text stays in
+    ChromaDB. Postings of common terms are kept sorted by impact; added
+    and removed chunks are updated in that order, and it is only rebuilt
+    once removals have shrunk it to half its size.
+    """
+
+    def __init__(self, path, k1=None, b=None):
+        """
+        Initialize the lexical index.
+
+        Args:
+            path (str): Path of the index JSON file
+            k1 (float): BM25 term frequency saturation (defaults to BM25_K1)
+            b (float): BM25 length normalization (defaults to BM25_B)
+        """
+        self.path = path
+        self.k1 = config.BM25_K1 if k1 is None else k1
+        self.b = config.BM25_B if b is None else b
+        self.dirty = False
+        self.searches = 0
+        self.last_search_time = 0.0
+        self._chunks = {}
+        self._postings = defaultdict(dict)
+        self._ranked = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        # mtime of the file as last loaded or saved by this process
+        self.mtime = None
+        self.exists = os.path.exists(path)
+        if self.exists:
+            self._load()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        try:
+            # Taken before reading, so a rewrite during the read is seen later
+            self.mtime = self._file_mtime()
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == LEXICAL_INDEX_VERSION:
+                for chunk_id, terms in data.get("chunks", {}).items():
+                    self._index(chunk_id, terms)
+            else:
+                logger.warning(
+                    "🟡 Lexical index version changed, it will be rebuilt")
+                self.exists = False
+        except Exception as e:
+            logger.error(f"🔴 Error loading lexical index: {e}")
+            self.exists = False
+
+    def save(self):
+        """
+        Write the index atomically if it has changed.
+
+        The index is copied under the lock and serialized outside it, so
+        searches aren't held up while a large index is written.
+        """
+        with self._save_lock:
+            with self._lock:
+                if not self.dirty and self.exists:
+                    return
+                # Term dicts are replaced, never modified, so a shallow copy
+                # is a consistent snapshot
+                chunks = dict(self._chunks)
+                self.dirty = False
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(
+                        {"version": LEXICAL_INDEX_VERSION, "chunks": chunks},
+                        f,
+                        separators=(",", ":"),
+                    )
+                os.replace(tmp_path, self.path)
+                self.mtime = self._file_mtime()
+                self.exists = True
+            except Exception as e:
+                with self._lock:
+                    self.dirty = True
+                logger.error(f"🔴 Error saving lexical index: {e}")
+
+    def reload_if_changed(self):
+        """
+        Reload the index if another process has rewritten its file since
+        this one last loaded or saved it. Under several workers, only the
+        one running an indexing job updates its index in memory.
+
+        Returns:
+            bool: True if the index was reloaded
+        """
+        mtime = self._file_mtime()
+        if mtime is None or mtime == self.mtime or self.dirty:
+            return False
+        # Skip while this process is saving; the mtime is updated after
+        if not self._save_lock.acquire(blocking=False):
+            return False
+        try:
+            fresh = LexicalIndex(self.path, self.k1, self.b)
+            if not fresh.exists:
+                return False
+            with self._lock:
+                if self.dirty:
+                    return False
+                self._chunks, self._postings = fresh._chunks, fresh._postings
+                self._ranked, self._lengths = fresh._ranked, fresh._lengths
+                self._total_length = fresh._total_length
+                self.mtime = fresh.mtime
+                self.exists = True
+        finally:
+            self._save_lock.release()
+        logger.info(
+            f"🟡 Reloaded lexical index changed by another process ({len(self)} chunks)")
+        return True
+
+    def _index(self, chunk_id, terms):
+        self._chunks[chunk_id] = terms
+        length = sum(terms.values())
+        self._lengths[chunk_id] = length
+        self._total_length += length
+        for term, frequency in terms.items():
+            self._postings[term][chunk_id] = frequency
+            ranked = self._ranked.get(term)
+            if ranked:
+                average_length = self._total_length / len(self._lengths) or 1
+                entry = (self._impact(chunk_id, frequency, average_length), chunk_id, frequency)
+                # Only entries above the lowest kept one are known to belong
+                if entry > ranked[0]:
+                    bisect.insort(ranked, entry)
+                    if len(ranked) > POSTINGS_LIMIT:
+                        del ranked[0]
+
+    def _unindex(self, chunk_id):
+        terms = self._chunks.pop(chunk_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings[term]
+            postings.pop(chunk_id, None)
+            ranked = self._ranked.get(term)
+            if ranked is not None:
+                for i, entry in enumerate(ranked):
+                    if entry[1] == chunk_id:
+                        # The rest are still the top postings, just fewer
+                        del ranked[i]
+                        break
+                if len(ranked) < POSTINGS_LIMIT // 2:
+                    del self._ranked[term]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._lengths.pop(chunk_id)
+
+    def add(self, chunk_id, text):
+        """
+        Index a chunk, replacing it if it was already indexed.
+
+        Args:
+            chunk_id (str): Chunk id in the collection
+            text (str): Chunk text
+        """
+        terms = dict(Counter(tokenize(text)))
+        with self._lock:
+            self._unindex(chunk_id)
+            self._index(chunk_id, terms)
+            self.dirty = True
+
+    def remove(self, chunk_ids):
+        """Drop chunks from the index"""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                self._unindex(chunk_id)
+            self.dirty = True
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def _norm(self, chunk_id, average_length):
+        """BM25 length normalization of a chunk"""
+        return self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / average_length)
+
+    def _impact(self, chunk_id, frequency, average_length):
+        """How much a term occurring `frequency` times adds to a chunk's score, before IDF"""
+        return frequency / (frequency + self._norm(chunk_id, average_length))
+
+    def _top_postings(self, term, average_length):
+        """
+        The POSTINGS_LIMIT highest-impact postings of a common term, as
+        (impact, chunk id, frequency) tuples in ascending impact order
+        """
+        ranked = self._ranked.get(term)
+        if ranked is None:
+            ranked = sorted(heapq.nlargest(
+                POSTINGS_LIMIT,
+                (
+                    (self._impact(chunk_id, frequency, average_length), chunk_id, frequency)
+                    for chunk_id, frequency in self._postings[term].items()
+                ),
+            ))
+            self._ranked[term] = ranked
+        return ranked
+
+    def search(self, query, n_results):
+        """
+        Rank chunks against a query by BM25.
+
+        Args:
+            query (str): The user's query
+            n_results (int): Number of chunks to return
+
+        Returns:
+            list: (chunk id, score) tuples, best match first
+        """
+        start_time = time.time()
+        terms = set(tokenize(query))
+        scores = defaultdict(float)
+        with self._lock:
+            count = len(self._lengths)
+            if count:
+                average_length = self._total_length / count or 1
+                for term in terms:
+                    postings = self._postings.get(term)
+                    if not postings:
+                        continue
+                    idf = math.log(
+                        1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    if len(postings) > POSTINGS_LIMIT:
+                        postings = (
+                            (chunk_id, frequency)
+                            for _, chunk_id, frequency in self._top_postings(term, average_length)
+                        )
+                    else:
+                        postings = postings.items()
+                    for chunk_id, frequency in postings:
+                        norm = self._norm(chunk_id, average_length)
+                        scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        results = heapq.nlargest(n_results, scores.items(), key=lambda item: item[1])
+        self.searches += 1
+        self.last_search_time = time.time() - start_time
+        return results
+
+    def rebuild_from_collection(self, collection):
+        """
+        Rebuild the index from the chunk text already in the collection.
+
+        Only used once, when a collection predates the lexical index.
+        """
+        logger.info("🟡 Rebuilding lexical index from collection")
+        start_time = time.time()
+        with self._lock:
+            self._chunks, self._lengths, self._ranked = {}, {}, {}
+            self._postings = defaultdict(dict)
+            self._total_length = 0
+        offset = 0
+        while True:
+            results = collection.get(
+                include=["documents"], limit=REBUILD_BATCH, offset=offset)
+            ids = results.get("ids") or []
+            for chunk_id, text in zip(ids, results.get("documents") or []):
+                self.add(chunk_id, text or "")
+            if len(ids) < REBUILD_BATCH:
+                break
+            offset += REBUILD_BATCH
+        self.dirty = True
+        self.save()
+        logger.info(
+            f"🟢 Rebuilt lexical index with {len(self)} chunks in {time.time() - start_time:.2f}s"
+        )
+
+    def get_stats(self):
+        """Get index counters as a dictionary"""
+        with self._lock:
+            return {
+                "chunks": len(self._chunks),
+                "terms": len(self._postings),
+                "searches": self.searches,
+                "last_search_ms": round(self.last_search_time * 1000, 2),
+            }
+
+
+# Shared lexical index instance
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index(collection=None):
+    """
+    Get the shared lexical index, rebuilding it from the collection the
+    first time if the collection has chunks but no index exists yet, and
+    reloading it if another process has saved a newer one.
+
+    Args:
+        collection: ChromaDB collection (optional, used for the one-time rebuild)
+
+    Returns:
+        LexicalIndex: The shared lexical index
+    """
+    global _lexical_index
+
+    with _lexical_index_lock:
+        if _lexical_index is None:
+            _lexical_index = LexicalIndex(config.LEXICAL_INDEX_PATH)
+        else:
+            _lexical_index.reload_if_changed()
+
+        if not _lexical_index.exists and collection is not None:
+            try:
+                if collection.count() > 0:
+                    _lexical_index.rebuild_from_collection(collection)
+                else:
+                    _lexical_index.save()
+            except Exception as e:
+                logger.error(f"🔴 Error rebuilding lexical index: {e}")
+
+        return _lexical_index
@@ -0,0 +1,273 @@
+import os
+import json
+import logging
+import threading
+import time
+import config
+from modules.utils import chunk_sources
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+class IndexManifest:
+    """
+    Sidecar record of what has been indexed into the vector database.
+
+    Maps each document (path relative to DOCS_DIR) to the chunk ids written
+    for it and the file's mtime, size and content hash at index time. Status
+    checks read this instead of pulling every chunk out of ChromaDB.
+
+    Identical chunks are stored once and shared between documents, so the
+    manifest also keeps a reverse index of the documents referencing each
+    chunk id; a chunk is only deleted once nothing references it.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the manifest.
+
+        Args:
+            path (str): Path of the manifest JSON file
+        """
+        self.path = path
+        self.sources = {}
+        self.dirty = False
+        self._refs = {}
+        self._lock = threading.RLock()
+        # mtime of the file as last loaded or saved by this process
+        self.mtime = None
+        self.exists = os.path.exists(path)
+        if self.exists:
+            self._load()
+
+    def _file_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        try:
+            # Taken before reading, so a rewrite during the read is seen later
+            self.mtime = self._file_mtime()
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.sources = data.get("sources", {})
+                self._index_refs()
+            else:
+                logger.warning(
+                    "🟡 Index manifest version changed, it will be rebuilt")
+                self.exists = False
+        except Exception as e:
+            logger.error(f"🔴 Error loading index manifest: {e}")
+            self.exists = False
+
+    def _index_refs(self):
+        """Rebuild the chunk id -> referencing documents index"""
+        self._refs = {}
+        for rel_path, entry in self.sources.items():
+            for chunk_id in entry["chunk_ids"]:
+                self._refs.setdefault(chunk_id, set()).add(rel_path)
+
+    def _unref(self, rel_path, chunk_ids):
+        for chunk_id in chunk_ids:
+            refs = self._refs.get(chunk_id)
+            if refs is not None:
+                refs.discard(rel_path)
+                if not refs:
+                    del self._refs[chunk_id]
+
+    def save(self):
+        """Write the manifest atomically if it has changed"""
+        with self._lock:
+            if not self.dirty and self.exists:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(
+                        {"version": MANIFEST_VERSION, "sources": self.sources}, f
+                    )
+                os.replace(tmp_path, self.path)
+                self.mtime = self._file_mtime()
+                self.dirty = False
+                self.exists = True
+            except Exception as e:
+                logger.error(f"🔴 Error saving index manifest: {e}")
+
+    def reload_if_changed(self):
+        """
+        Reload the manifest if another process has rewritten its file since
+        this one last loaded or saved it.
+
+        Returns:
+            bool: True if the manifest was reloaded
+        """
+        mtime = self._file_mtime()
+        if mtime is None or mtime == self.mtime or self.dirty:
+            return False
+        fresh = IndexManifest(self.path)
+        if not fresh.exists:
+            return False
+        with self._lock:
+            # Unsaved changes of this process win over the file
+            if self.dirty:
+                return False
+            self.sources, self._refs = fresh.sources, fresh._refs
+            self.mtime = fresh.mtime
+            self.exists = True
+        logger.info(
+            f"🟡 Reloaded index manifest changed by another process ({len(self.sources)} documents)")
+        return True
+
+    def get(self, rel_path):
+        """Get the manifest entry for a document, or None"""
+        with self._lock:
+            return self.sources.get(rel_path)
+
+    def record(self, rel_path, source, chunk_ids, mtime, size, content_hash):
+        """
+        Record the chunks written for a document.
+
+        Args:
+            rel_path (str): Document path relative to DOCS_DIR
+            source (str): Source path stored in chunk metadata
+            chunk_ids (list): Ids of the chunks in the collection
+            mtime (float): File modification time at index time
+            size (int): File size at index time
+            content_hash (str): SHA-256 of the file content
+        """
+        with self._lock:
+            previous = self.sources.get(rel_path)
+            if previous is not None:
+                self._unref(rel_path, previous["chunk_ids"])
+            for chunk_id in chunk_ids:
+                self._refs.setdefault(chunk_id, set()).add(rel_path)
+            self.sources[rel_path] = {
+                "source": source,
+                "chunk_ids": list(chunk_ids),
+                "mtime": mtime,
+                "size": size,
+                "hash": content_hash,
+                "indexed_at": time.time(),
+            }
+            self.dirty = True
+
+    def touch(self, rel_path, mtime, size):
+        """Update the recorded mtime and size of a document whose content is unchanged"""
+        with self._lock:
+            entry = self.sources.get(rel_path)
+            if entry is not None:
+                entry["mtime"] = mtime
+                entry["size"] = size
+                self.dirty = True
+
+    def remove(self, rel_path):
+        """Forget a document, returning its entry if there was one"""
+        with self._lock:
+            entry = self.sources.pop(rel_path, None)
+            if entry is not None:
+                self._unref(rel_path, entry["chunk_ids"])
+                self.dirty = True
+            return entry
+
+    def referrers(self, chunk_id):
+        """Paths of the documents whose chunks include a chunk id"""
+        with self._lock:
+            return set(self._refs.get(chunk_id, ()))
+
+    def paths(self):
+        """Paths of all recorded documents"""
+        with self._lock:
+            return list(self.sources)
+
+    def chunk_count(self):
+        """Total number of distinct chunks recorded"""
+        with self._lock:
+            return len(self._refs)
+
+    def rebuild_from_collection(self, collection, docs_dir):
+        """
+        Rebuild the manifest from chunk metadata already in the collection.
+
+        Only used once, when a collection predates the manifest. Reads ids
+        and metadata only, never chunk text or embeddings.
+        """
+        logger.info("🟡 Rebuilding index manifest from collection metadata")
+        start_time = time.time()
+        results = collection.get(include=["metadatas"])
+        sources = {}
+        for chunk_id, metadata in zip(results.get("ids") or [], results.get("metadatas") or []):
+            if not metadata:
+                continue
+            # A shared chunk belongs to every document it lists
+            for source in chunk_sources(metadata):
+                source = os.path.normpath(source)
+                rel_path = os.path.relpath(source, docs_dir)
+                entry = sources.setdefault(
+                    rel_path,
+                    {
+                        "source": source,
+                        "chunk_ids": [],
+                        # Only mtime was stored in chunk metadata
+                        "mtime": float(metadata.get("mtime", 0) or 0),
+                        "size": None,
+                        "hash": None,
+                        "indexed_at": None,
+                    },
+                )
+                entry["chunk_ids"].append(chunk_id)
+
+        with self._lock:
+            self.sources = sources
+            self._index_refs()
+            self.dirty = True
+        self.save()
+        logger.info(
+            f"🟢 Rebuilt index manifest with {len(sources)} documents in {time.time() - start_time:.2f}s"
+        )
+
+
+# Shared manifest instance
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest(collection=None, docs_dir=None):
+    """
+    Get the shared index manifest, rebuilding it from the collection the
+    first time if the collection has chunks but no manifest exists yet, and
+    reloading it if another process has saved a newer one.
+
+    Args:
+        collection: ChromaDB collection (optional, used for the one-time rebuild)
+        docs_dir (str): Documentation directory (defaults to DOCS_DIR)
+
+    Returns:
+        IndexManifest: The shared manifest
+    """
+    global _manifest
+
+    with _manifest_lock:
+        if _manifest is None:
+            _manifest = IndexManifest(config.INDEX_MANIFEST_PATH)
+        else:
+            _manifest.reload_if_changed()
+
+        if not _manifest.exists and collection is not None:
+            try:
+                if collection.count() > 0:
+                    _manifest.rebuild_from_collection(
+                        collection, docs_dir or config.DOCS_DIR)
+                else:
+                    _manifest.save()
+            except Exception as e:
+                logger.error(f"🔴 Error rebuilding index manifest: {e}")
+
+        return _manifest
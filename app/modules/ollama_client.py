@@ -1,7 +1,11 @@
 import logging
+import threading
 import time
+from collections import OrderedDict
 import config
+import httpx
 import ollama
+from modules.prompt_builder import build_prompt, build_turn_prompt
 
 logger = logging.getLogger(__name__)
 
@@ -9,6 +13,47 @@ logger = logging.getLogger(__name__)
 MAX_RETRIES = 3
 RETRY_DELAY = 2
 
+# Shared Ollama clients, one per host
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(host=None):
+    """
+    Get the shared Ollama client for a host.
+
+    The client wraps a single thread-safe httpx connection pool, so generation,
+    embeddings and status checks reuse keep-alive connections instead of paying
+    TCP setup on every call.
+
+    Args:
+        host (str): Ollama base URL (defaults to config.OLLAMA_HOST)
+
+    Returns:
+        ollama.Client: Client bound to the host
+    """
+    host = (host or config.OLLAMA_HOST).rstrip("/")
+
+    with _clients_lock:
+        client = _clients.get(host)
+        if client is None:
+            client = ollama.Client(
+                host=host,
+                timeout=httpx.Timeout(
+                    config.OLLAMA_READ_TIMEOUT, connect=config.OLLAMA_CONNECT_TIMEOUT
+                ),
+                limits=httpx.Limits(
+                    max_connections=config.OLLAMA_POOL_SIZE,
+                    max_keepalive_connections=config.OLLAMA_POOL_SIZE,
+                    keepalive_expiry=config.OLLAMA_KEEPALIVE_EXPIRY,
+                ),
+            )
+            _clients[host] = client
+            logger.info(
+                f"🟢 Created Ollama client for {host} (pool size {config.OLLAMA_POOL_SIZE})"
+            )
+        return client
+
 
 def fetch_model_info():
     """
@@ -21,12 +66,9 @@ def fetch_model_info():
 
     for attempt in range(MAX_RETRIES):
         try:
-            # Set Ollama host
-            ollama.host = config.OLLAMA_HOST
-
             # Get model details - adding error handling in case model doesn't exist
             try:
-                response = ollama.show(config.OLLAMA_MODEL)
+                response = get_client().show(config.OLLAMA_MODEL)
                 logger.debug(f"Ollama show response type: {type(response)}")
             except Exception as e:
                 if "not found" in str(e).lower():
@@ -140,48 +182,208 @@ def fetch_model_info():
     return model_info
 
 
-def generate_response(message, context, history):
+class SessionContextStore:
+    """
+    Keeps the context state Ollama returns for each chat session so the next
+    turn can continue from it instead of re-sending the whole history.
+    Bounded LRU; an evicted session simply falls back to a full prompt.
     """
-    Generate a response from the Ollama API.
-
-    Args:
-        message (str): The user message
-        context (str): Relevant context from the vector database
-        history (list): Conversation history
 
-    Returns:
-        tuple: (response_text, success_flag)
+    def __init__(self, max_sessions=256, max_tokens=4096):
+        """
+        Initialize the session context store.
+
+        Args:
+            max_sessions (int): Maximum number of sessions to keep state for
+            max_tokens (int): Drop state once it grows past this many tokens
+        """
+        self.max_sessions = max_sessions
+        self.max_tokens = max_tokens
+        self.hits = 0
+        self.misses = 0
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, message_count):
+        """
+        Get the cached context for a session if it is still usable.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+            message_count (int): Number of messages before the latest one,
+                counting those trimmed from the history
+
+        Returns:
+            list: Context tokens, or None if the prompt must be rebuilt
+        """
+        with self._lock:
+            state = self._states.get(session_id)
+            if (
+                state
+                and state["model"] == config.OLLAMA_MODEL
+                and state["message_count"] == message_count
+            ):
+                self._states.move_to_end(session_id)
+                self.hits += 1
+                return state["context"]
+            self.misses += 1
+            return None
+
+    def put(self, session_id, message_count, context):
+        """
+        Store the context returned by Ollama for a session.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+            message_count (int): Number of messages the context covers,
+                counting those trimmed from the history
+            context (list): Context tokens returned by Ollama
+        """
+        with self._lock:
+            if not context or len(context) > self.max_tokens:
+                # Too long to keep extending; rebuild from history next turn
+                self._states.pop(session_id, None)
+                return
+            self._states[session_id] = {
+                "context": list(context),
+                "message_count": message_count,
+                "model": config.OLLAMA_MODEL,
+            }
+            self._states.move_to_end(session_id)
+            while len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+
+    def discard(self, session_id):
+        """Forget the cached context for a session"""
+        with self._lock:
+            self._states.pop(session_id, None)
+
+    def get_stats(self):
+        """Get store counters as a dictionary"""
+        return {
+            "sessions": len(self._states),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Shared per-session context state
+session_contexts = SessionContextStore(
+    max_sessions=config.OLLAMA_SESSION_CACHE_SIZE,
+    max_tokens=config.OLLAMA_SESSION_CONTEXT_MAX_TOKENS,
+)
+
+# Generation options shared by the blocking and streaming paths
+GENERATION_OPTIONS = {
+    "temperature": 0.7,
+    "num_predict": 2048,  # Maximum response length
+}
+
+
+def _response_text(response):
+    """Extract the generated text from a (possibly partial) generate response"""
+    # Try attribute access first (for typed objects)
+    if hasattr(response, "response"):
+        return response.response or ""
+    # Fall back to dictionary access
+    return response.get("response", "")
+
+
+def _response_context(response):
+    """Extract the context tokens from a final generate response"""
+    if hasattr(response, "context"):
+        return response.context
+    return response.get("context")
+
+
+def _response_done(response):
+    """Whether a streamed generate response is the final one"""
+    if hasattr(response, "done"):
+        return bool(response.done)
+    return bool(response.get("done"))
+
+
+def _prepare_request(message, context, history, session_id, summary=None, history_offset=0):
     """
-    # Format the history for inclusion in the prompt
-    history_prompt = "\nConversation history:\n" + "\n".join(
-        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
-        for msg in history[
-            :-1
-        ]  # Exclude the latest message which we'll include separately
-    )
+    Decide between continuing a cached session and sending a full prompt.
 
-    # Build the prompt based on whether we have context
-    if context and context.strip() and len(context.strip()) > 10:
-        prompt = f"""You are a helpful network troubleshooting assistant.
-Here's some context from the knowledge base that might be relevant:
+    Cached state is matched on the total number of messages in the
+    session, history_offset plus len(history). That total keeps growing
+    once the tracker caps the history, so long sessions still match.
 
-{context}
+    Returns:
+        tuple: (prompt, cached_context, stats) where cached_context is None for a full prompt
+    """
+    if config.OLLAMA_REUSE_CONTEXT and session_id is not None:
+        cached_context = session_contexts.get(
+            session_id, history_offset + len(history) - 1)
+        if cached_context:
+            # The cached tokens count against the budget too
+            turn_budget = config.PROMPT_TOKEN_BUDGET - len(cached_context)
+            prompt, stats = build_turn_prompt(message, context, turn_budget)
+            if prompt is not None:
+                logger.debug(
+                    f"Continuing session {session_id} from {len(cached_context)} cached tokens"
+                )
+                stats["cached_tokens"] = len(cached_context)
+                return prompt, cached_context, stats
+            session_contexts.discard(session_id)
 
-{history_prompt}
+    prompt, stats = build_prompt(message, context, history, summary=summary)
+    return prompt, None, stats
 
-User's latest message: {message}
 
-Respond in a helpful and informative way. All troubleshooting should be done through natural conversation.
-"""
+def _record_usage(usage, stats, response):
+    """Log prompt token usage and copy it into the caller's usage dict"""
+    if hasattr(response, "prompt_eval_count"):
+        actual = response.prompt_eval_count
     else:
-        prompt = f"""You are a helpful network troubleshooting assistant.
-
-{history_prompt}
+        actual = response.get("prompt_eval_count")
+    logger.info(
+        f"🟢 Prompt used ~{stats['prompt_tokens']} of {stats['budget']} budgeted tokens "
+        f"(context {stats['context_tokens']}, history {stats['history_tokens']}, "
+        f"evaluated by model: {actual if actual is not None else 'n/a'})"
+    )
+    if usage is not None:
+        usage.update(stats)
+        usage["prompt_eval_count"] = actual
+
+
+def _generate_kwargs(prompt, cached_context, stream=False):
+    """Keyword arguments for a generate call"""
+    kwargs = {
+        "model": config.OLLAMA_MODEL,
+        "prompt": prompt,
+        "options": GENERATION_OPTIONS,
+        "keep_alive": config.OLLAMA_KEEP_ALIVE,
+        "stream": stream,
+    }
+    if cached_context:
+        kwargs["context"] = cached_context
+    return kwargs
+
+
+def generate_response(
+    message, context, history, session_id=None, usage=None, summary=None,
+    history_offset=0,
+):
+    """
+    Generate a response from the Ollama API.
 
-User's latest message: {message}
+    Args:
+        message (str): The user message
+        context: RetrievalResult or context string from the vector database
+        history (list): Conversation history
+        session_id (str): Session to reuse cached model context for (optional)
+        usage (dict): Filled with prompt token usage if provided (optional)
+        summary (dict): Running summary of older turns (optional)
+        history_offset (int): Messages already trimmed before the history
 
-Respond in a helpful and informative way. All troubleshooting should be done through natural conversation.
-"""
+    Returns:
+        tuple: (response_text, success_flag)
+    """
+    prompt, cached_context, stats = _prepare_request(
+        message, context, history, session_id, summary, history_offset)
 
     # Call the Ollama API with retries
     for attempt in range(MAX_RETRIES):
@@ -189,29 +391,23 @@ Respond in a helpful and informative way. All troubleshooting should be done thr
             logger.info(
                 f"🟡 Generating response, attempt {attempt+1}/{MAX_RETRIES}")
 
-            # Set Ollama host
-            ollama.host = config.OLLAMA_HOST
-
-            response = ollama.generate(
-                model=config.OLLAMA_MODEL,
-                prompt=prompt,
-                options={
-                    "temperature": 0.7,
-                    "num_predict": 2048,  # Maximum response length
-                },
-            )
+            response = get_client().generate(
+                **_generate_kwargs(prompt, cached_context))
 
             if response:
-                # Try attribute access first (for typed objects)
-                if hasattr(response, "response"):
-                    assistant_response = response.response
-                else:
-                    # Fall back to dictionary access
-                    assistant_response = response.get("response", "")
+                assistant_response = _response_text(response)
 
                 if not assistant_response:
                     logger.warning("🟡 Empty response received from Ollama")
 
+                _record_usage(usage, stats, response)
+
+                if config.OLLAMA_REUSE_CONTEXT and session_id is not None:
+                    # History plus the reply we're about to append
+                    session_contexts.put(
+                        session_id, history_offset + len(history) + 1, _response_context(response)
+                    )
+
                 logger.info(
                     f"🟢 Response generated successfully ({len(assistant_response)} chars)"
                 )
@@ -220,6 +416,12 @@ Respond in a helpful and informative way. All troubleshooting should be done thr
         except Exception as e:
             logger.warning(
                 f"🟡 Attempt {attempt+1}/{MAX_RETRIES}: Request error: {e}")
+            if cached_context:
+                # The cached state may be unusable; rebuild the full prompt
+                session_contexts.discard(session_id)
+                prompt, stats = build_prompt(
+                    message, context, history, summary=summary)
+                cached_context = None
 
         # Only sleep if we're going to retry
         if attempt < MAX_RETRIES - 1:
@@ -230,6 +432,84 @@ Respond in a helpful and informative way. All troubleshooting should be done thr
     return error_message, False
 
 
+def generate_response_stream(
+    message, context, history, session_id=None, usage=None, summary=None,
+    history_offset=0,
+):
+    """
+    Generate a response from the Ollama API, yielding tokens as they arrive.
+
+    Requests are retried only until the first token has been produced; once
+    output has been streamed to the client a failure is raised instead.
+
+    Args:
+        message (str): The user message
+        context: RetrievalResult or context string from the vector database
+        history (list): Conversation history
+        session_id (str): Session to reuse cached model context for (optional)
+        usage (dict): Filled with prompt token usage if provided (optional)
+        summary (dict): Running summary of older turns (optional)
+        history_offset (int): Messages already trimmed before the history
+
+    Yields:
+        str: Pieces of the response text
+    """
+    prompt, cached_context, stats = _prepare_request(
+        message, context, history, session_id, summary, history_offset)
+
+    for attempt in range(MAX_RETRIES):
+        produced = False
+        try:
+            logger.info(
+                f"🟡 Streaming response, attempt {attempt+1}/{MAX_RETRIES}")
+            start_time = time.time()
+
+            stream = get_client().generate(
+                **_generate_kwargs(prompt, cached_context, stream=True))
+
+            for part in stream:
+                token = _response_text(part)
+                if token:
+                    if not produced:
+                        logger.info(
+                            f"🟢 First token after {time.time() - start_time:.2f}s")
+                    produced = True
+                    yield token
+                if _response_done(part):
+                    _record_usage(usage, stats, part)
+                    if config.OLLAMA_REUSE_CONTEXT and session_id is not None:
+                        session_contexts.put(
+                            session_id, history_offset + len(history) + 1, _response_context(part)
+                        )
+
+            logger.info(
+                f"🟢 Response streamed successfully in {time.time() - start_time:.2f}s")
+            return
+
+        except Exception as e:
+            if produced:
+                logger.error(f"🔴 Stream interrupted: {e}")
+                if session_id is not None:
+                    session_contexts.discard(session_id)
+                raise
+            logger.warning(
+                f"🟡 Attempt {attempt+1}/{MAX_RETRIES}: Request error: {e}")
+            if cached_context:
+                # The cached state may be unusable; rebuild the full prompt
+                session_contexts.discard(session_id)
+                prompt, stats = build_prompt(
+                    message, context, history, summary=summary)
+                cached_context = None
+
+        # Only sleep if we're going to retry
+        if attempt < MAX_RETRIES - 1:
+            time.sleep(RETRY_DELAY)
+
+    error_message = f"Failed to generate response after {MAX_RETRIES} attempts"
+    logger.error(f"🔴 {error_message}")
+    raise RuntimeError(error_message)
+
+
 def check_ollama_connection():
     """
     Check if Ollama is available at the configured host.
@@ -242,11 +522,8 @@ def check_ollama_connection():
 
     for attempt in range(MAX_RETRIES):
         try:
-            # Set Ollama host
-            ollama.host = config.OLLAMA_HOST
-
             # Get list of models
-            list_response = ollama.list()
+            list_response = get_client().list()
             logger.info(
                 f"🟢 Successfully connected to Ollama at {config.OLLAMA_HOST}")
 
@@ -2,7 +2,10 @@ import numpy as np
 from typing import List, Union
 import logging
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import ollama
+from modules.ollama_client import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -16,7 +19,7 @@ class OllamaEmbeddingFunction:
     # Default embedding dimension if the API fails
     DEFAULT_EMBEDDING_DIM = 1536
 
-    def __init__(self, ollama_base_url, model_name, batch_size=10):
+    def __init__(self, ollama_base_url, model_name, batch_size=10, concurrency=1):
         """
         Initialize the Ollama embedding function.
 
@@ -24,13 +27,19 @@ class OllamaEmbeddingFunction:
             ollama_base_url: Base URL of the Ollama API (e.g., "http://localhost:11434")
             model_name: Name of the Ollama model to use for embeddings
             batch_size: Number of texts to batch together in one request
+            concurrency: Maximum number of batch requests in flight at once
         """
         logger.info(
             f"🟡 Initializing OllamaEmbeddingFunction with URL: {ollama_base_url} and model: {model_name}"
         )
         self.ollama_base_url = ollama_base_url.rstrip("/")
         self.model_name = model_name
-        self.batch_size = batch_size
+        self.batch_size = max(1, int(batch_size))
+        self.concurrency = max(1, int(concurrency))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # None until the first batch request tells us whether /api/embed exists
+        self._batch_supported = None
 
         # Verify connection to Ollama
         try:
@@ -47,11 +56,9 @@ class OllamaEmbeddingFunction:
         """Test the connection to the Ollama API"""
         logger.info(f"🟡 Testing API connection with model {self.model_name}")
 
-        # Set Ollama host
-        ollama.host = self.ollama_base_url
-
         # Test embeddings API
-        response = ollama.embeddings(model=self.model_name, prompt="test")
+        response = get_client(self.ollama_base_url).embeddings(
+            model=self.model_name, prompt="test")
 
         # Log successful response
         if response and "embedding" in response:
@@ -69,11 +76,9 @@ class OllamaEmbeddingFunction:
                 f"🟡 Requesting embedding for text of length {len(text)}")
             start_time = time.time()
 
-            # Set Ollama host
-            ollama.host = self.ollama_base_url
-
             # Get embedding
-            response = ollama.embeddings(model=self.model_name, prompt=text)
+            response = get_client(self.ollama_base_url).embeddings(
+                model=self.model_name, prompt=text)
 
             elapsed = time.time() - start_time
 
@@ -92,6 +97,100 @@ class OllamaEmbeddingFunction:
             # Return zeros as fallback - as a list, not numpy array
             return [0.0] * self.DEFAULT_EMBEDDING_DIM
 
+    def _get_embeddings_batch(self, texts):
+        """
+        Get embeddings for a batch of texts in a single request.
+
+        Uses Ollama's multi-input embed endpoint. Raises if the server does not
+        support it or returns a malformed response, so the caller can fall back
+        to per-text requests.
+        """
+        logger.debug(f"🟡 Requesting batch embedding for {len(texts)} texts")
+        start_time = time.time()
+
+        response = get_client(self.ollama_base_url).embed(
+            model=self.model_name, input=texts)
+
+        if hasattr(response, "embeddings"):
+            embeddings = response.embeddings
+        else:
+            embeddings = response.get("embeddings")
+
+        if not embeddings or len(embeddings) != len(texts):
+            raise ValueError(
+                f"Expected {len(texts)} embeddings, got {len(embeddings) if embeddings else 0}"
+            )
+
+        elapsed = time.time() - start_time
+        logger.debug(
+            f"🟢 Got {len(embeddings)} embeddings in {elapsed:.2f}s")
+        return [list(embedding) for embedding in embeddings]
+
+    def _embed_batch(self, batch):
+        """Embed a batch, falling back to one request per text if needed"""
+        if self._batch_supported is not False:
+            try:
+                embeddings = self._get_embeddings_batch(batch)
+                self._batch_supported = True
+                return embeddings
+            except ollama.ResponseError as e:
+                # Older Ollama servers don't expose /api/embed
+                if e.status_code == 404:
+                    logger.warning(
+                        "🟡 Ollama server does not support batch embeddings, falling back to per-text requests"
+                    )
+                    self._batch_supported = False
+                else:
+                    logger.warning(
+                        f"🟡 Batch embedding failed, retrying per text: {e}")
+            except Exception as e:
+                logger.warning(
+                    f"🟡 Batch embedding failed, retrying per text: {e}")
+
+        # Get embeddings one by one as a list of floats, not numpy arrays
+        return [self._get_embedding(text) for text in batch]
+
+    def _get_executor(self):
+        """Lazily create the shared thread pool used for concurrent batches"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.concurrency,
+                    thread_name_prefix="ollama-embed",
+                )
+            return self._executor
+
+    def _embed_batches_concurrently(self, batches):
+        """
+        Embed batches with at most `concurrency` requests outstanding.
+
+        Batches are submitted through a sliding window so large inputs don't
+        queue thousands of futures at once. Results are returned in input order.
+        """
+        executor = self._get_executor()
+        results = [None] * len(batches)
+        in_flight = {}
+        next_batch = 0
+        completed = 0
+
+        while completed < len(batches):
+            # Top up the window
+            while next_batch < len(batches) and len(in_flight) < self.concurrency:
+                future = executor.submit(self._embed_batch, batches[next_batch])
+                in_flight[future] = next_batch
+                next_batch += 1
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = in_flight.pop(future)
+                results[index] = future.result()
+                completed += 1
+
+            if len(batches) > 1:
+                logger.info(f"Processed batch {completed}/{len(batches)}")
+
+        return [embedding for batch in results for embedding in batch]
+
     def __call__(self, input: Union[str, List[str]]) -> List[List[float]]:
         """
         Generate embeddings for a text or list of texts.
@@ -110,29 +209,30 @@ class OllamaEmbeddingFunction:
             texts = input
             logger.info(f"Called with {len(texts)} texts to embed")
 
+        if not texts:
+            return []
+
         all_embeddings = []
         start_time = time.time()
+        batches = [
+            texts[i: i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        ]
 
-        # Process in batches to avoid overloading Ollama
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i: i + self.batch_size]
-            batch_start = time.time()
-
-            # Get embeddings one by one (Ollama library doesn't support batching yet)
-            batch_embeddings = []
-            for text in batch:
-                # Get embedding as a list of floats, not numpy array
-                embedding = self._get_embedding(text)
-                batch_embeddings.append(embedding)
-
-            all_embeddings.extend(batch_embeddings)
-            batch_elapsed = time.time() - batch_start
-
-            # Log progress for long batches
-            if len(texts) > self.batch_size:
-                logger.info(
-                    f"Processed batch {i//self.batch_size + 1}/{(len(texts)-1)//self.batch_size + 1} in {batch_elapsed:.2f}s"
-                )
+        if self.concurrency > 1 and len(batches) > 1:
+            all_embeddings = self._embed_batches_concurrently(batches)
+        else:
+            # Process in batches to avoid overloading Ollama
+            for batch_number, batch in enumerate(batches, start=1):
+                batch_start = time.time()
+
+                all_embeddings.extend(self._embed_batch(batch))
+                batch_elapsed = time.time() - batch_start
+
+                # Log progress for long batches
+                if len(batches) > 1:
+                    logger.info(
+                        f"Processed batch {batch_number}/{len(batches)} in {batch_elapsed:.2f}s"
+                    )
 
         total_time = time.time() - start_time
         logger.info(
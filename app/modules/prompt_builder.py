@@ -0,0 +1,313 @@
+import logging
+import config
+from modules.utils import estimate_tokens, source_label, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+# Shortest shared prefix/suffix treated as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 16
+
+# Don't bother keeping a trimmed chunk or turn smaller than this
+MIN_TRIMMED_TOKENS = 32
+
+PROMPT_HEADER = "You are a helpful network troubleshooting assistant."
+CONTEXT_INTRO = "Here's some context from the knowledge base that might be relevant:"
+TURN_CONTEXT_INTRO = (
+    "Here's some additional context from the knowledge base that might be relevant:"
+)
+SUMMARY_INTRO = "Summary of the earlier conversation:"
+PROMPT_FOOTER = "Respond in a helpful and informative way. All troubleshooting should be done through natural conversation."
+
+
+def context_chunks(context):
+    """
+    Normalize retrieved context into a ranked list of (source, text) pairs.
+
+    Args:
+        context: A RetrievalResult, or a preformatted context string
+
+    Returns:
+        list: (source, text) tuples, best match first
+    """
+    if context is None:
+        return []
+    if isinstance(context, str):
+        # Preformatted context (or an error/unavailable notice) is one block
+        if context.strip() and len(context.strip()) > 10:
+            return [(None, context.strip())]
+        return []
+    if getattr(context, "error", None):
+        return [(None, context.error)]
+    return [
+        (source_label(metadata) if metadata else None, doc)
+        for doc, metadata in zip(context.documents, context.metadatas)
+        if doc
+    ]
+
+
+def _overlap_length(left, right, max_overlap):
+    """Length of the longest suffix of `left` that is also a prefix of `right`"""
+    longest = min(len(left), len(right), max_overlap)
+    for length in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:length]):
+            return length
+    return 0
+
+
+def dedupe_chunks(chunks, max_overlap=None):
+    """
+    Remove repeated text between retrieved chunks.
+
+    Chunks fully contained in a higher-ranked chunk are dropped, and text a
+    chunk shares with a neighbouring chunk of the same source (the overlap
+    added by the chunker) is stripped.
+
+    Args:
+        chunks (list): (source, text) tuples in rank order
+        max_overlap (int): Longest overlap to look for, in characters
+
+    Returns:
+        list: De-duplicated (source, text) tuples in the same order
+    """
+    if max_overlap is None:
+        overlap_chars = config.CHUNK_OVERLAP * (
+            config.CHARS_PER_TOKEN if config.CHUNK_BY_TOKENS else 1)
+        max_overlap = max(overlap_chars * 2, MIN_OVERLAP_CHARS)
+
+    kept = []
+    for source, text in chunks:
+        text = text.strip()
+        if not text or any(text in other for _, other in kept):
+            continue
+
+        for other_source, other in kept:
+            if other_source != source:
+                continue
+            # Shared text at our start (we follow `other`)...
+            length = _overlap_length(other, text, max_overlap)
+            if length:
+                text = text[length:].lstrip()
+            # ...or at our end (we precede `other`)
+            length = _overlap_length(text, other, max_overlap)
+            if length:
+                text = text[:-length].rstrip()
+
+        if text:
+            kept.append((source, text))
+    return kept
+
+
+def _format_chunk(source, text):
+    """Format a retrieved chunk for the prompt"""
+    if source is None:
+        return text
+    return f"--- From {source} ---\n{text}"
+
+
+def _format_turn(msg):
+    """Format a conversation turn for the prompt"""
+    return f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+
+
+def fit_chunks(chunks, budget):
+    """
+    Select chunks in rank order until the token budget is spent.
+
+    The first chunk that doesn't fit is trimmed if a useful amount of budget
+    is left; everything ranked below it is dropped.
+
+    Returns:
+        tuple: (formatted chunks, tokens used, number of chunks dropped)
+    """
+    selected, used = [], 0
+    for index, (source, text) in enumerate(chunks):
+        block = _format_chunk(source, text)
+        tokens = estimate_tokens(block)
+        if used + tokens <= budget:
+            selected.append(block)
+            used += tokens
+            continue
+
+        remaining = budget - used
+        if remaining >= MIN_TRIMMED_TOKENS:
+            block = truncate_to_tokens(block, remaining)
+            selected.append(block)
+            used += estimate_tokens(block)
+            index += 1
+        return selected, used, len(chunks) - index
+    return selected, used, 0
+
+
+def fit_history(history, budget):
+    """
+    Select the most recent conversation turns that fit the token budget.
+
+    Returns:
+        tuple: (formatted turns oldest first, tokens used, number of turns dropped)
+    """
+    selected, used = [], 0
+    for index, msg in enumerate(reversed(history)):
+        line = _format_turn(msg)
+        tokens = estimate_tokens(line) + 1
+        if used + tokens <= budget:
+            selected.append(line)
+            used += tokens
+            continue
+
+        remaining = budget - used
+        if remaining >= MIN_TRIMMED_TOKENS:
+            line = truncate_to_tokens(line, remaining - 1)
+            selected.append(line)
+            used += estimate_tokens(line) + 1
+            index += 1
+        selected.reverse()
+        return selected, used, len(history) - index
+    selected.reverse()
+    return selected, used, 0
+
+
+def build_prompt(message, context, history, budget=None, summary=None):
+    """
+    Build the generation prompt from context, history and the latest message,
+    keeping it within a token budget.
+
+    Retrieved chunks get up to PROMPT_CONTEXT_SHARE of the space left after
+    the fixed parts of the prompt; history gets the rest, newest turns first.
+    Budget history doesn't use goes back to lower-ranked chunks. When a
+    running summary is given, it replaces the turns it covers.
+
+    Args:
+        message (str): The user message
+        context: RetrievalResult or context string from the vector database
+        history (list): Conversation history, ending with the latest message
+        budget (int): Token budget for the prompt (defaults to PROMPT_TOKEN_BUDGET)
+        summary (dict): Running summary from ConversationTracker.get_summary (optional)
+
+    Returns:
+        tuple: (prompt, stats) where stats records estimated token usage
+    """
+    budget = budget or config.PROMPT_TOKEN_BUDGET
+    chunks = dedupe_chunks(context_chunks(context))
+    # Skip turns folded into the summary, and exclude the latest message
+    # which we'll include separately
+    summarized = summary["message_count"] if summary else 0
+    previous = history[summarized:-1]
+
+    fixed = "\n\n".join(
+        [PROMPT_HEADER, CONTEXT_INTRO if chunks else "",
+         "Conversation history:", f"User's latest message: {message}", PROMPT_FOOTER]
+    )
+    available = max(budget - estimate_tokens(fixed), 0)
+
+    # The summary comes first, capped so it can't crowd out everything else
+    summary_text = ""
+    if summary and summary.get("text"):
+        summary_text = truncate_to_tokens(
+            f"{SUMMARY_INTRO}\n{summary['text']}", available // 3)
+    summary_tokens = estimate_tokens(summary_text)
+    available -= summary_tokens
+
+    context_budget = int(available * config.PROMPT_CONTEXT_SHARE)
+    context_blocks, context_tokens, _ = fit_chunks(chunks, context_budget)
+    history_lines, history_tokens, turns_dropped = fit_history(
+        previous, available - context_tokens
+    )
+
+    # Give budget history didn't need back to lower-ranked chunks
+    leftover = available - context_tokens - history_tokens
+    if leftover > 0 and len(context_blocks) < len(chunks):
+        context_blocks, context_tokens, _ = fit_chunks(
+            chunks, context_tokens + leftover)
+    chunks_dropped = len(chunks) - len(context_blocks)
+
+    context_text = "\n\n".join(context_blocks)
+    history_prompt = "\nConversation history:\n" + "\n".join(history_lines)
+    if summary_text:
+        history_prompt = f"\n{summary_text}\n{history_prompt}"
+
+    # Build the prompt based on whether we have context
+    if context_text:
+        prompt = f"""{PROMPT_HEADER}
+{CONTEXT_INTRO}
+
+{context_text}
+
+{history_prompt}
+
+User's latest message: {message}
+
+{PROMPT_FOOTER}
+"""
+    else:
+        prompt = f"""{PROMPT_HEADER}
+
+{history_prompt}
+
+User's latest message: {message}
+
+{PROMPT_FOOTER}
+"""
+
+    stats = {
+        "budget": budget,
+        "prompt_tokens": estimate_tokens(prompt),
+        "context_tokens": context_tokens,
+        "history_tokens": history_tokens,
+        "summary_tokens": summary_tokens,
+        "chunks_used": len(context_blocks),
+        "chunks_dropped": chunks_dropped,
+        "turns_summarized": summarized,
+        "turns_used": len(history_lines),
+        "turns_dropped": turns_dropped,
+    }
+    return prompt, stats
+
+
+def build_turn_prompt(message, context, budget):
+    """
+    Build the prompt for a single turn that continues a cached session.
+
+    The conversation so far is already held in the model's context state, so
+    only the new retrieved context and the latest message are sent.
+
+    Args:
+        message (str): The user message
+        context: RetrievalResult or context string from the vector database
+        budget (int): Tokens available for this turn's prompt
+
+    Returns:
+        tuple: (prompt, stats), or (None, stats) if the message alone doesn't fit
+    """
+    chunks = dedupe_chunks(context_chunks(context))
+    fixed = f"{TURN_CONTEXT_INTRO}\n\nUser's latest message: {message}"
+    available = budget - estimate_tokens(fixed)
+
+    stats = {"budget": budget, "prompt_tokens": 0,
+             "context_tokens": 0, "history_tokens": 0}
+    if available < 0:
+        return None, stats
+
+    context_blocks, context_tokens, chunks_dropped = fit_chunks(
+        chunks, available)
+    context_text = "\n\n".join(context_blocks)
+
+    if context_text:
+        prompt = f"""{TURN_CONTEXT_INTRO}
+
+{context_text}
+
+User's latest message: {message}
+"""
+    else:
+        prompt = f"""User's latest message: {message}
+"""
+
+    stats.update(
+        {
+            "prompt_tokens": estimate_tokens(prompt),
+            "context_tokens": context_tokens,
+            "chunks_used": len(context_blocks),
+            "chunks_dropped": chunks_dropped,
+        }
+    )
+    return prompt, stats
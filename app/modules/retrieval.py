@@ -0,0 +1,304 @@
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+import config
+from modules import chromadb_handler
+from modules.lexical_index import get_lexical_index
+from modules.utils import chunk_sources, source_label, sources_metadata
+
+logger = logging.getLogger(__name__)
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of query text -> embedding with a time-to-live.
+    Repeated questions skip the embedding round trip entirely.
+    """
+
+    def __init__(self, max_entries=256, ttl=600):
+        """
+        Initialize the query embedding cache.
+
+        Args:
+            max_entries (int): Maximum number of query embeddings to keep
+            ttl (float): Seconds before a cached embedding expires
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(text):
+        """
+        Normalize query whitespace so trivial spacing changes still hit.
+        Case is kept, since embedding models are case-sensitive.
+        """
+        return " ".join(text.split())
+
+    def get_or_compute(self, text, embedding_function):
+        """
+        Return the embedding for a query, computing and caching it on a miss.
+
+        Args:
+            text (str): Query text
+            embedding_function: Callable taking a list of texts
+
+        Returns:
+            list: The query embedding
+        """
+        key = self._normalize(text)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Embed the key itself so every query sharing it gets the same vector
+        embedding = list(embedding_function([key])[0])
+        if not any(embedding):
+            # The all-zero fallback for a failed embedding must not be reused
+            return embedding
+
+        with self._lock:
+            self._entries[key] = (embedding, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return embedding
+
+    def get_stats(self):
+        """Get cache counters as a dictionary"""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class RetrievalResult:
+    """
+    Result of a single search, carrying everything a chat turn needs:
+    documents, metadatas and distances from one query.
+    """
+
+    def __init__(self, ids=None, documents=None, metadatas=None, distances=None, error=None):
+        self.ids = ids or []
+        self.documents = documents or []
+        self.metadatas = metadatas or []
+        self.distances = distances or []
+        self.error = error
+        self.timings = {}
+
+    @property
+    def context(self):
+        """Retrieved chunks formatted for inclusion in the prompt"""
+        if self.error:
+            return self.error
+        context = ""
+        for doc, metadata in zip(self.documents, self.metadatas):
+            context += f"\n--- From {source_label(metadata)} ---\n{doc}\n"
+        return context
+
+    @property
+    def sources(self):
+        """Base names of the source documents, in rank order"""
+        sources = []
+        for metadata in self.metadatas:
+            for source in chunk_sources(metadata):
+                name = os.path.basename(source)
+                if name not in sources:
+                    sources.append(name)
+        return sources
+
+    def __bool__(self):
+        return bool(self.documents)
+
+
+# Shared query embedding cache
+query_embedding_cache = QueryEmbeddingCache(
+    max_entries=config.QUERY_CACHE_SIZE, ttl=config.QUERY_CACHE_TTL
+)
+
+
+def merge_duplicates(ids, documents, metadatas, distances):
+    """
+    Collapse hits with identical text into the best-ranked one.
+
+    Chunks indexed before identical text was shared between documents are
+    still stored once per document; the hit kept lists all of their sources.
+
+    Returns:
+        tuple: (ids, documents, metadatas, distances) without repeats
+    """
+    kept = {}
+    merged = ([], [], [], [])
+    for hit in zip(ids, documents, metadatas, distances):
+        index = kept.get(hit[1])
+        if index is None:
+            kept[hit[1]] = len(merged[0])
+            for column, value in zip(merged, hit):
+                column.append(value)
+            continue
+        sources = chunk_sources(merged[2][index])
+        sources += [s for s in chunk_sources(hit[2]) if s not in sources]
+        if sources:
+            merged[2][index] = {**merged[2][index], **sources_metadata(sources)}
+    return merged
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """
+    Merge rankings by reciprocal rank fusion.
+
+    Each id scores 1 / (k + rank) in every ranking it appears in, ranks
+    starting at 1, so ids ranked well by several retrievers rise to the top
+    without comparing their raw scores.
+
+    Args:
+        rankings (list): Lists of ids, best first
+        k (int): Rank offset damping the lead of top ranks (defaults to RRF_K)
+
+    Returns:
+        list: Ids ordered by fused score, best first
+    """
+    k = config.RRF_K if k is None else k
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def _fuse(collection, query, hits, n_results, timings):
+    """
+    Fuse vector hits with lexical hits for the same query.
+
+    Args:
+        collection: ChromaDB collection, for the text of lexical-only hits
+        query (str): The user's query
+        hits (dict): Vector hits, chunk id -> (document, metadata, distance),
+            in rank order
+        n_results (int): Number of chunks to return
+        timings (dict): Per-stage timings, updated in place
+
+    Returns:
+        list: (id, document, metadata, distance) tuples in fused order;
+              lexical-only hits have no distance
+    """
+    start_time = time.time()
+    lexical_hits = get_lexical_index().search(
+        query, max(n_results, config.HYBRID_CANDIDATES))
+    timings["lexical_ms"] = round((time.time() - start_time) * 1000, 1)
+
+    start_time = time.time()
+    ranked = reciprocal_rank_fusion(
+        [list(hits), [chunk_id for chunk_id, _ in lexical_hits]])[:n_results]
+    timings["fusion_ms"] = round((time.time() - start_time) * 1000, 1)
+
+    missing = [chunk_id for chunk_id in ranked if chunk_id not in hits]
+    if missing:
+        start_time = time.time()
+        fetched = collection.get(ids=missing, include=["documents", "metadatas"])
+        for chunk_id, document, metadata in zip(
+                fetched.get("ids") or [], fetched.get("documents") or [],
+                fetched.get("metadatas") or []):
+            hits[chunk_id] = (document, metadata, None)
+        timings["fetch_ms"] = round((time.time() - start_time) * 1000, 1)
+
+    return [(chunk_id, *hits[chunk_id]) for chunk_id in ranked if chunk_id in hits]
+
+
+def retrieve(collection, query, n_results=config.SEARCH_RESULTS):
+    """
+    Search for the chunks most relevant to a query.
+
+    With HYBRID_SEARCH, the top HYBRID_CANDIDATES chunks of a vector search
+    and of a BM25 keyword search are fused by reciprocal rank fusion, so a
+    chunk naming the exact device, address or site in the query is found
+    even when its embedding is not among the nearest.
+
+    Args:
+        collection: ChromaDB collection
+        query (str): The user's query
+        n_results (int): Number of chunks to retrieve
+
+    Returns:
+        RetrievalResult: Documents, metadatas and distances for the query,
+            with per-stage timings
+    """
+    if not config.CHROMA_AVAILABLE or collection is None:
+        return RetrievalResult(
+            error="Vector search not available. Using default knowledge.")
+
+    try:
+        hybrid = config.HYBRID_SEARCH and len(get_lexical_index()) > 0
+        candidates = max(n_results, config.HYBRID_CANDIDATES) if hybrid else n_results
+        query_args = {}
+        search_start = start_time = time.time()
+        emb_fn = chromadb_handler.active_embedding_function
+        if emb_fn is not None:
+            query_args["query_embeddings"] = [
+                query_embedding_cache.get_or_compute(query, emb_fn)
+            ]
+        else:
+            query_args["query_texts"] = [query]
+        embed_elapsed = time.time() - start_time
+
+        # Set include parameter to fetch all relevant metadata but avoid adding new vectors
+        results = chromadb_handler.query_with_timing(
+            collection,
+            n_results=candidates,
+            include=["documents", "metadatas", "distances"],
+            **query_args,
+        )
+        if results is None:
+            raise RuntimeError(
+                chromadb_handler.db_status.last_error or "query failed")
+
+        timings = {
+            "embed_ms": round(embed_elapsed * 1000, 1),
+            "vector_ms": round(chromadb_handler.db_status.last_query_time * 1000, 1),
+        }
+        hits = list(zip(
+            (results.get("ids") or [[]])[0],
+            (results.get("documents") or [[]])[0],
+            (results.get("metadatas") or [[]])[0],
+            (results.get("distances") or [[]])[0],
+        ))
+        if hybrid:
+            hits = _fuse(
+                collection,
+                query,
+                {chunk_id: hit for chunk_id, *hit in hits},
+                n_results,
+                timings,
+            )
+        else:
+            hits = hits[:n_results]
+
+        ids, documents, metadatas, distances = merge_duplicates(
+            *(list(column) for column in zip(*hits))) if hits else ([], [], [], [])
+        result = RetrievalResult(
+            ids=ids, documents=documents, metadatas=metadatas, distances=distances)
+        timings["total_ms"] = round((time.time() - search_start) * 1000, 1)
+        result.timings = timings
+        logger.info(
+            f"🟢 Retrieved {len(ids)} chunks in {timings['total_ms']}ms ("
+            + ", ".join(f"{stage[:-3]} {ms}ms" for stage, ms in timings.items()
+                        if stage != "total_ms")
+            + ")"
+        )
+        return result
+    except Exception as e:
+        logger.error(f"🔴 Error querying vector database: {e}")
+        return RetrievalResult(error="🔴 Error retrieving context from database.")
@@ -0,0 +1,147 @@
+import logging
+import queue
+import threading
+import time
+import config
+from modules.ollama_client import get_client
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = """You maintain a running summary of a network troubleshooting conversation.
+Update the summary with the new messages below. Keep every concrete diagnostic
+fact: site names and codes, device names, interface names, IP addresses, VLANs,
+circuit IDs, error messages, steps already tried and their results, and open
+questions. Drop pleasantries and repetition. Reply with the updated summary only.
+
+Current summary:
+{summary}
+
+New messages:
+{messages}
+"""
+
+
+class ConversationSummarizer:
+    """
+    Folds older conversation turns into a running per-session summary on a
+    background thread, so long sessions keep a roughly constant prompt size
+    without losing early diagnostic facts.
+
+    Summaries are incremental: each pass only folds in the turns added since
+    the previous one. The most recent turns are always left verbatim.
+    """
+
+    def __init__(self, tracker, keep_recent=6, min_new_messages=4):
+        """
+        Initialize the summarizer.
+
+        Args:
+            tracker: ConversationTracker holding the sessions and summaries
+            keep_recent (int): Number of latest messages never summarized
+            min_new_messages (int): Messages to accumulate before a new pass
+        """
+        self.tracker = tracker
+        self.keep_recent = keep_recent
+        self.min_new_messages = min_new_messages
+        self.runs = 0
+        self.failures = 0
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, session_id):
+        """
+        Queue a session for summarization. Returns immediately; sessions that
+        are already queued are not queued twice.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+        """
+        with self._lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="conversation-summarizer", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(session_id)
+
+    def _run(self):
+        """Worker loop"""
+        while True:
+            session_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(session_id)
+            try:
+                self.summarize(session_id)
+            except Exception as e:
+                self.failures += 1
+                logger.error(
+                    f"🔴 Error summarizing session {session_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def summarize(self, session_id):
+        """
+        Fold any new turns older than the recent window into the summary.
+
+        Args:
+            session_id (str): Unique identifier for the conversation
+
+        Returns:
+            bool: True if the summary was updated
+        """
+        # The offset pins fold_until to these messages, however many older
+        # ones are trimmed while the summary is generated
+        history, offset, current = self.tracker.get_snapshot(session_id)
+        current = current or {"text": "", "message_count": 0}
+
+        fold_until = len(history) - self.keep_recent
+        new_messages = history[current["message_count"]: fold_until]
+        if len(new_messages) < self.min_new_messages:
+            return False
+
+        start_time = time.time()
+        prompt = SUMMARY_PROMPT.format(
+            summary=current["text"] or "(none yet)",
+            messages="\n".join(
+                f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}"
+                for msg in new_messages
+            ),
+        )
+        response = get_client().generate(
+            model=config.SUMMARY_MODEL,
+            prompt=prompt,
+            options={"temperature": 0.2,
+                     "num_predict": config.SUMMARY_MAX_TOKENS},
+            keep_alive=config.OLLAMA_KEEP_ALIVE,
+        )
+        if hasattr(response, "response"):
+            summary = response.response
+        else:
+            summary = response.get("response", "")
+
+        if not summary or not summary.strip():
+            logger.warning(
+                f"🟡 Empty summary returned for session {session_id}")
+            return False
+
+        self.tracker.set_summary(
+            session_id, summary.strip(), fold_until, offset=offset)
+        self.runs += 1
+        logger.info(
+            f"🟢 Summarized {len(new_messages)} messages for session {session_id} "
+            f"in {time.time() - start_time:.2f}s ({fold_until} messages folded in total)"
+        )
+        return True
+
+    def get_stats(self):
+        """Get summarizer counters as a dictionary"""
+        return {
+            "queued": self._queue.qsize(),
+            "runs": self.runs,
+            "failures": self.failures,
+        }
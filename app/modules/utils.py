@@ -1,9 +1,315 @@
+import os
 import re
+import itertools
 import logging
+import datetime
+import yaml
 import config
 
 logger = logging.getLogger(__name__)
 
+# Maximum ids per collection or SQLite call that binds one parameter per id.
+# SQLite before 3.32 rejects statements with more than 999 parameters.
+ID_BATCH_SIZE = 500
+
+
+# Paragraph separators, and sentence ends inside oversized paragraphs
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+")
+
+
+def _paragraphs(text):
+    """Yield paragraphs, each with its trailing separator"""
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        yield text[start: match.end()]
+        start = match.end()
+    if start < len(text):
+        yield text[start:]
+
+
+def iter_chunks(text, chunk_size=None, overlap=None, by_tokens=None):
+    """
+    Lazily split text into overlapping chunks, preserving paragraph and then
+    sentence boundaries when possible.
+
+    Runs in one pass over the text: paragraphs are packed into chunks as
+    they are found, and only paragraphs too big for a chunk are split into
+    sentences (and sentences too big for a chunk into fixed windows).
+
+    Args:
+        text (str): The text to split
+        chunk_size (int): Maximum size of each chunk (defaults to CHUNK_SIZE)
+        overlap (int): Size of the tail of each chunk repeated at the start
+            of the next one (defaults to CHUNK_OVERLAP)
+        by_tokens (bool): Measure sizes in estimated tokens instead of
+            characters (defaults to CHUNK_BY_TOKENS)
+
+    Yields:
+        str: Text chunks in document order
+    """
+    for context, body in iter_chunk_parts(text, chunk_size, overlap, by_tokens):
+        yield context + body
+
+
+def iter_chunk_parts(text, chunk_size=None, overlap=None, by_tokens=None):
+    """
+    Split text like iter_chunks, keeping each chunk's overlap apart.
+
+    The overlap depends on the text before the chunk, so the body alone is
+    what identifies the chunk's own content.
+
+    Yields:
+        tuple: (overlap repeated from the previous chunk, chunk body)
+    """
+    chunk_size = config.CHUNK_SIZE if chunk_size is None else chunk_size
+    overlap = config.CHUNK_OVERLAP if overlap is None else overlap
+    by_tokens = config.CHUNK_BY_TOKENS if by_tokens is None else by_tokens
+
+    measure = estimate_tokens if by_tokens else len
+    scale = config.CHARS_PER_TOKEN if by_tokens else 1
+    window, overlap_chars = chunk_size * scale, overlap * scale
+
+    # Handle empty or very small text
+    if not text:
+        return
+    if measure(text) <= chunk_size:
+        yield "", text
+        return
+
+    def pieces():
+        for para in _paragraphs(text):
+            if measure(para) <= chunk_size:
+                yield para
+                continue
+            # If paragraph is too big for a chunk, split it by sentences
+            for sentence in SENTENCE_BREAK.split(para):
+                if measure(sentence) > chunk_size:
+                    # Split the long sentence arbitrarily
+                    step = max(window - overlap_chars, 1)
+                    for i in range(0, len(sentence), step):
+                        yield sentence[i: i + window]
+                elif sentence:
+                    yield sentence + " "
+
+    previous = None
+    parts, size = [], 0
+    for piece in itertools.chain(pieces(), [None]):
+        piece_size = measure(piece) if piece is not None else 0
+        if parts and (piece is None or size + piece_size > chunk_size):
+            chunk = "".join(parts).strip()
+            parts, size = [], 0
+            if chunk:
+                # Prefix the tail of the previous chunk if it still fits
+                tail = previous[-overlap_chars:] if previous and overlap_chars else ""
+                previous = chunk
+                if not tail or measure(tail) + measure(chunk) > chunk_size:
+                    tail = ""
+                yield tail, chunk
+        if piece is not None:
+            parts.append(piece)
+            size += piece_size
+
+
+# ATX headings and code fences, matched one line at a time
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})[ \t]+(.+?)[ \t#]*$")
+MARKDOWN_FENCE = re.compile(r"^\s*(```|~~~)")
+
+
+def iter_markdown_sections(text):
+    """
+    Split Markdown into sections at ATX headings.
+
+    Headings inside fenced code blocks and YAML front matter are ignored.
+    Text before the first heading (including any front matter) is yielded
+    as a section with an empty heading path.
+
+    Args:
+        text (str): Markdown text
+
+    Yields:
+        tuple: (heading path as a list of titles, section text including
+                its heading line)
+    """
+    lines = text.splitlines(keepends=True)
+    start = 0
+    if lines and lines[0].strip() == "---":
+        # Front matter runs to the next "---" line
+        for i in range(1, len(lines)):
+            if lines[i].strip() == "---":
+                start = i + 1
+                break
+
+    path, section, in_fence = [], lines[:start], False
+    for line in lines[start:]:
+        if MARKDOWN_FENCE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else MARKDOWN_HEADING.match(line.rstrip("\r\n"))
+        if match:
+            yield [title for _, title in path], "".join(section)
+            section = []
+            level = len(match.group(1))
+            while path and path[-1][0] >= level:
+                path.pop()
+            path.append((level, match.group(2).strip()))
+        section.append(line)
+    yield [title for _, title in path], "".join(section)
+
+
+def iter_markdown_chunks(text, chunk_size=None, overlap=None, by_tokens=None):
+    """
+    Split Markdown into chunks that never cross a heading.
+
+    Each section becomes one chunk, prefixed with the titles of its parent
+    headings so the chunk still says what it is about. Only sections too
+    big for a chunk are split further with iter_chunks. Sections with no
+    text beyond their heading are skipped.
+
+    Args:
+        text (str): Markdown text
+        chunk_size (int): Maximum size of each chunk (defaults to CHUNK_SIZE)
+        overlap (int): Overlap used when splitting oversized sections
+            (defaults to CHUNK_OVERLAP)
+        by_tokens (bool): Measure sizes in estimated tokens instead of
+            characters (defaults to CHUNK_BY_TOKENS)
+
+    Yields:
+        tuple: (heading path as a list of titles, chunk text)
+    """
+    for path, context, body in iter_markdown_parts(text, chunk_size, overlap, by_tokens):
+        yield path, context + body
+
+
+def iter_markdown_parts(text, chunk_size=None, overlap=None, by_tokens=None):
+    """
+    Split Markdown like iter_markdown_chunks, keeping each chunk's context
+    apart.
+
+    The context is the parent heading titles plus any overlap from the
+    previous piece of the same section. It depends on where the chunk sits,
+    so the same section in two documents has the same body.
+
+    Yields:
+        tuple: (heading path as a list of titles, context, chunk body)
+    """
+    chunk_size = config.CHUNK_SIZE if chunk_size is None else chunk_size
+    by_tokens = config.CHUNK_BY_TOKENS if by_tokens is None else by_tokens
+    measure = estimate_tokens if by_tokens else len
+
+    for path, section in iter_markdown_sections(text):
+        body = section.strip()
+        if not body or (path and "\n" not in body):
+            continue
+
+        prefix = " > ".join(path[:-1])
+        if prefix:
+            prefix += "\n\n"
+        # Leave room for the prefix, but never less than half a chunk
+        budget = max(chunk_size - measure(prefix), chunk_size // 2)
+
+        if measure(body) <= budget:
+            yield path, prefix, body
+            continue
+        for tail, piece in iter_chunk_parts(body, budget, overlap, by_tokens):
+            yield path, prefix + tail, piece
+
+
+# Record fields copied into chunk metadata when present
+YAML_METADATA_FIELDS = ("region", "site_code", "status")
+
+
+def _is_scalar(value):
+    # Anything YAML parses that isn't a collection: strings, numbers,
+    # booleans, null, but also unquoted dates and timestamps
+    return not isinstance(value, (dict, list))
+
+
+def _scalar_text(value):
+    """String form of a YAML scalar, with dates in ISO format"""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def _is_leaf(value):
+    """Whether a YAML value holds only scalars and lists of scalars"""
+    if isinstance(value, dict):
+        return all(_is_scalar(v) or (isinstance(v, list) and all(map(_is_scalar, v)))
+                   for v in value.values())
+    return _is_scalar(value) or (isinstance(value, list) and all(map(_is_scalar, value)))
+
+
+def _plain_yaml(value):
+    """Copy of a YAML value with timestamps as ISO strings, which flow style
+    would otherwise write with an explicit !!timestamp tag"""
+    if isinstance(value, dict):
+        return {key: _plain_yaml(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_plain_yaml(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _compact_yaml(value):
+    """One-line YAML flow serialization"""
+    if _is_scalar(value):
+        return _scalar_text(value)
+    return yaml.safe_dump(
+        _plain_yaml(value), default_flow_style=True, sort_keys=False, width=float("inf")
+    ).strip()
+
+
+def iter_yaml_records(data, path=()):
+    """
+    Split parsed YAML into one record per entity.
+
+    A mapping whose values are all scalars (a site, a device, a circuit) is
+    one record, and so is each such item of a list. A larger mapping or list
+    keeps its own scalar values as a record and is recursed into for the rest.
+
+    Args:
+        data: Parsed YAML
+        path (tuple): Keys leading to `data`
+
+    Yields:
+        tuple: (key path, text, metadata) where the text is the key path and
+               a compact serialization of the entity
+    """
+    key_path = ".".join(str(key) for key in path)
+
+    if _is_leaf(data):
+        if data is None or data == {} or data == []:
+            return
+        metadata = {"key_path": key_path}
+        # regions.<name>.… places an entity in a region
+        for parent, key in zip(path, path[1:]):
+            if parent == "regions":
+                metadata["region"] = str(key)
+        if isinstance(data, dict):
+            for field in YAML_METADATA_FIELDS:
+                if _is_scalar(data.get(field)) and data.get(field) is not None:
+                    metadata[field] = _scalar_text(data[field])
+        text = _compact_yaml(data)
+        yield key_path, f"{key_path}: {text}" if key_path else text, metadata
+        return
+
+    if isinstance(data, dict):
+        attributes = {key: value for key, value in data.items() if _is_leaf(value)
+                      and not isinstance(value, dict)}
+        if attributes:
+            yield from iter_yaml_records(attributes, path)
+        for key, value in data.items():
+            if key not in attributes:
+                yield from iter_yaml_records(value, path + (key,))
+    else:
+        scalars = [item for item in data if _is_scalar(item)]
+        if scalars:
+            yield from iter_yaml_records(scalars, path)
+        for i, item in enumerate(data):
+            if not _is_scalar(item):
+                yield from iter_yaml_records(item, path + (i,))
+
 
 def split_into_chunks(text, chunk_size=config.CHUNK_SIZE, overlap=config.CHUNK_OVERLAP):
     """
@@ -12,111 +318,97 @@ def split_into_chunks(text, chunk_size=config.CHUNK_SIZE, overlap=config.CHUNK_O
     Args:
         text (str): The text to split
         chunk_size (int): Maximum size of each chunk
-        overlap (int): Number of characters to overlap between chunks
+        overlap (int): Size of the overlap between chunks
 
     Returns:
         list: List of text chunks
     """
-    # Handle empty or very small text
-    if not text or len(text) <= chunk_size:
-        return [text] if text else []
-
-    chunks = []
-    # Split text into paragraphs (preserving empty lines)
-    paragraphs = re.split(r"(\n\s*\n)", text)
-
-    # Recombine paragraph with its separator
-    para_texts = []
-    for i in range(0, len(paragraphs), 2):
-        if i + 1 < len(paragraphs):
-            para_texts.append(paragraphs[i] + paragraphs[i + 1])
-        else:
-            para_texts.append(paragraphs[i])
-
-    current_chunk = ""
-
-    for para in para_texts:
-        # If paragraph is too big for a chunk, split it by sentences
-        if len(para) > chunk_size:
-            logger.debug(
-                f"Paragraph size {len(para)} exceeds chunk size {chunk_size}, splitting by sentences"
-            )
-            sentences = re.split(r"(?<=[.!?])\s+", para)
-            para_chunks = []
-            para_chunk = ""
-
-            for sentence in sentences:
-                # If the sentence itself is too long, we'll need to split it arbitrarily
-                if len(sentence) > chunk_size:
-                    logger.debug(
-                        f"Sentence size {len(sentence)} exceeds chunk size {chunk_size}, splitting by characters"
-                    )
-                    # If we have content in para_chunk, save it first
-                    if para_chunk:
-                        para_chunks.append(para_chunk)
-                        para_chunk = ""
-
-                    # Split the long sentence
-                    for i in range(0, len(sentence), chunk_size - overlap):
-                        para_chunks.append(sentence[i: i + chunk_size])
-
-                # Otherwise, follow normal logic
-                elif len(para_chunk) + len(sentence) <= chunk_size:
-                    para_chunk += sentence + " "
-                else:
-                    para_chunks.append(para_chunk)
-                    para_chunk = sentence + " "
-
-            # Don't forget the last chunk
-            if para_chunk:
-                para_chunks.append(para_chunk)
-
-            # Now we have chunks for this paragraph, add them to main chunks
-            for pc in para_chunks:
-                if current_chunk and len(current_chunk) + len(pc) <= chunk_size:
-                    current_chunk += pc
-                else:
-                    if current_chunk:
-                        chunks.append(current_chunk.strip())
-                    current_chunk = pc
-
-        # Normal paragraph that fits within chunk size
-        elif len(current_chunk) + len(para) <= chunk_size:
-            current_chunk += para
-        else:
-            chunks.append(current_chunk.strip())
-            current_chunk = para
-
-    # Don't forget the last chunk
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-
-    # Handle overlap for chunks if needed
-    if overlap > 0 and len(chunks) > 1:
-        overlapped_chunks = [chunks[0]]
-
-        for i in range(1, len(chunks)):
-            prev_chunk = chunks[i - 1]
-            current_chunk = chunks[i]
-
-            # Take the last 'overlap' characters from previous chunk
-            overlap_text = (
-                prev_chunk[-overlap:] if len(
-                    prev_chunk) > overlap else prev_chunk
-            )
-
-            # Only add overlap if it doesn't make the chunk too big
-            if len(overlap_text) + len(current_chunk) <= chunk_size:
-                overlapped_chunks.append(overlap_text + current_chunk)
-            else:
-                overlapped_chunks.append(current_chunk)
-
-        chunks = overlapped_chunks
-
+    chunks = list(iter_chunks(text, chunk_size, overlap))
     logger.debug(f"Split text into {len(chunks)} chunks")
     return chunks
 
 
+# Separates the paths in the "sources" metadata of a shared chunk
+SOURCES_SEPARATOR = "\n"
+
+
+def chunk_sources(metadata):
+    """
+    Get the source paths of a chunk.
+
+    A chunk shared by several documents lists all of them under "sources";
+    "source" holds the first, and is all a single-document chunk has.
+
+    Args:
+        metadata (dict): Chunk metadata
+
+    Returns:
+        list: Source paths, first source first
+    """
+    if not metadata:
+        return []
+    if metadata.get("sources"):
+        return metadata["sources"].split(SOURCES_SEPARATOR)
+    return [metadata["source"]] if "source" in metadata else []
+
+
+def source_label(metadata):
+    """Base names of a chunk's sources, for display"""
+    return ", ".join(os.path.basename(source) for source in chunk_sources(metadata))
+
+
+def sources_metadata(sources):
+    """
+    Build the metadata update recording which documents share a chunk.
+
+    Args:
+        sources (list): Source paths, first source first
+
+    Returns:
+        dict: "source" and "sources" metadata values
+    """
+    return {"source": sources[0], "sources": SOURCES_SEPARATOR.join(sources)}
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of model tokens in a text.
+
+    Uses a characters-per-token ratio, which is close enough for budgeting
+    without loading the model's tokenizer.
+
+    Args:
+        text (str): The text to measure
+
+    Returns:
+        int: Approximate token count
+    """
+    if not text:
+        return 0
+    return -(-len(text) // config.CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Trim text to roughly max_tokens, cutting at a word boundary.
+
+    Args:
+        text (str): The text to trim
+        max_tokens (int): Approximate token limit
+
+    Returns:
+        str: The trimmed text, marked with an ellipsis if anything was cut
+    """
+    max_chars = max_tokens * config.CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[: max(max_chars - 2, 0)]
+    space = cut.rfind(" ")
+    if space > max_chars // 2:
+        cut = cut[:space]
+    return cut.rstrip() + " …"
+
+
 def format_file_size(size_bytes):
     """
     Format file size from bytes to human-readable format.
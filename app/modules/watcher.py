@@ -0,0 +1,218 @@
+import os
+import logging
+import threading
+import time
+import config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from inotify_simple import INotify, flags
+
+    INOTIFY_AVAILABLE = True
+except ImportError:
+    INOTIFY_AVAILABLE = False
+
+VALID_EXTENSIONS = (".txt", ".md", ".yaml", ".yml")
+
+
+class DocsWatcher:
+    """
+    Turns document changes into targeted background reindexes.
+
+    Changed paths come from the save_doc hook and, when watching is enabled,
+    from inotify (or periodic polling where inotify isn't available). Each
+    path waits until it has been quiet for the debounce period, then all due
+    paths are submitted together as one incremental indexing job.
+    """
+
+    def __init__(self, docs_dir, job_manager, debounce_seconds=None, poll_interval=None):
+        """
+        Initialize the watcher.
+
+        Args:
+            docs_dir (str): Documentation directory
+            job_manager (IndexJobManager): Where reindex jobs are submitted
+            debounce_seconds (float): Quiet time before a changed file is reindexed
+            poll_interval (float): Seconds between scans when polling
+        """
+        self.docs_dir = docs_dir
+        self.job_manager = job_manager
+        self.debounce_seconds = (
+            config.WATCH_DEBOUNCE_SECONDS if debounce_seconds is None else debounce_seconds
+        )
+        self.poll_interval = poll_interval or config.WATCH_POLL_INTERVAL
+        self.mode = "off"
+        self.jobs_submitted = 0
+        self.files_submitted = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._debounce_thread = None
+        self._watch_thread = None
+
+    def start(self):
+        """Start watching DOCS_DIR for changes"""
+        if self._watch_thread is not None:
+            return
+        os.makedirs(self.docs_dir, exist_ok=True)
+        if INOTIFY_AVAILABLE:
+            self.mode = "inotify"
+            target = self._watch_inotify
+        else:
+            self.mode = "polling"
+            target = self._watch_polling
+        self._watch_thread = threading.Thread(
+            target=target, name="docs-watcher", daemon=True)
+        self._watch_thread.start()
+        logger.info(
+            f"🟢 Watching {self.docs_dir} for document changes ({self.mode})")
+
+    def notify(self, rel_path):
+        """
+        Record a changed document. It is reindexed once it has had no further
+        changes for the debounce period.
+
+        Args:
+            rel_path (str): Document path relative to DOCS_DIR
+        """
+        rel_path = os.path.normpath(rel_path)
+        name = os.path.basename(rel_path)
+        if name.startswith(".") or not name.endswith(VALID_EXTENSIONS):
+            return
+        with self._lock:
+            self._pending[rel_path] = time.time()
+            if self._debounce_thread is None or not self._debounce_thread.is_alive():
+                self._debounce_thread = threading.Thread(
+                    target=self._run_debounce, name="docs-watcher-debounce", daemon=True
+                )
+                self._debounce_thread.start()
+        self._wake.set()
+
+    def _run_debounce(self):
+        """Submit changed documents once they have been quiet long enough"""
+        timeout = None
+        while True:
+            # Sleep until the next pending path is due, or the next change
+            self._wake.wait(timeout)
+            self._wake.clear()
+            now = time.time()
+            with self._lock:
+                due = [
+                    rel_path
+                    for rel_path, changed_at in self._pending.items()
+                    if now - changed_at >= self.debounce_seconds
+                ]
+                for rel_path in due:
+                    del self._pending[rel_path]
+                timeout = None
+                if self._pending:
+                    timeout = max(
+                        0.05,
+                        min(self._pending.values()) + self.debounce_seconds - now,
+                    )
+            if due:
+                self._submit(sorted(due))
+
+    def _submit(self, rel_paths):
+        try:
+            job = self.job_manager.submit(specific_files=rel_paths)
+            self.jobs_submitted += 1
+            self.files_submitted += len(rel_paths)
+            logger.info(
+                f"🟡 Reindexing {len(rel_paths)} changed documents as job {job.id}")
+        except Exception as e:
+            logger.error(f"🔴 Error submitting reindex of changed documents: {e}")
+
+    def _watch_inotify(self):
+        """Watch the directory tree with inotify"""
+        inotify = INotify()
+        mask = (
+            flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM
+            | flags.CREATE | flags.DELETE
+        )
+        watches = {}
+
+        def add_tree(path, notify_files=False):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                try:
+                    watches[inotify.add_watch(root, mask)] = root
+                except OSError as e:
+                    logger.warning(f"🟡 Can't watch {root}: {e}")
+                if notify_files:
+                    for file in files:
+                        self.notify(os.path.relpath(
+                            os.path.join(root, file), self.docs_dir))
+
+        add_tree(self.docs_dir)
+        while True:
+            try:
+                for event in inotify.read():
+                    directory = watches.get(event.wd)
+                    if event.mask & flags.IGNORED:
+                        watches.pop(event.wd, None)
+                        continue
+                    if directory is None or not event.name:
+                        continue
+                    path = os.path.join(directory, event.name)
+                    if event.mask & flags.ISDIR:
+                        # A directory created or moved in brings its files along
+                        if event.mask & (flags.CREATE | flags.MOVED_TO):
+                            add_tree(path, notify_files=True)
+                        continue
+                    if event.mask & flags.CREATE:
+                        # Wait for CLOSE_WRITE once the file has been written
+                        continue
+                    self.notify(os.path.relpath(path, self.docs_dir))
+            except Exception as e:
+                logger.error(f"🔴 Error watching documents: {e}")
+                time.sleep(self.poll_interval)
+
+    def _scan(self):
+        """Stat every document under DOCS_DIR"""
+        snapshot = {}
+        stack = [self.docs_dir]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(VALID_EXTENSIONS):
+                            stat = entry.stat()
+                            snapshot[os.path.relpath(entry.path, self.docs_dir)] = (
+                                stat.st_mtime_ns,
+                                stat.st_size,
+                            )
+            except OSError as e:
+                logger.warning(f"🟡 Can't scan {directory}: {e}")
+        return snapshot
+
+    def _watch_polling(self):
+        """Watch the directory tree by comparing periodic scans"""
+        previous = self._scan()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                current = self._scan()
+                for rel_path in set(previous) | set(current):
+                    if previous.get(rel_path) != current.get(rel_path):
+                        self.notify(rel_path)
+                previous = current
+            except Exception as e:
+                logger.error(f"🔴 Error watching documents: {e}")
+
+    def get_stats(self):
+        """Get watcher counters as a dictionary"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "mode": self.mode,
+            "pending": pending,
+            "jobs_submitted": self.jobs_submitted,
+            "files_submitted": self.files_submitted,
+        }